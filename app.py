@@ -1,9 +1,20 @@
-from io import BytesIO
+import codecs
+import csv
+import hashlib
+import os
+import re
+import stat
+import tempfile
+from datetime import datetime
+from io import BytesIO, StringIO
 from typing import List, Optional
 
 import altair as alt
 import duckdb
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import streamlit as st
 
 st.set_page_config(page_title="구매 데이터 대시보드", layout="wide")
@@ -164,135 +175,791 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+# 향상된 컬럼 매핑 로직 - 각 변형들을 개별적으로 처리
+COLUMN_MAPPINGS = [
+    # 공급업체 관련
+    (["업체명", "공급업체명", "밤더명"], "공급업체명"),
+    (["공급업체", "공급사코드", "공급업체코드", "밤더코드"], "공급업체코드"),
+    # 구매그룹 관련
+    (["구매그룹명", "구매그룹"], "구매그룹"),
+    # 송장 관련
+    (["송장금액", "인보이스금액", "발주금액"], "송장금액"),
+    (["송장수량", "인보이스수량", "발주수량"], "송장수량"),
+    # 자재 관련
+    (["자재", "자재코드", "자재번호"], "자재"),
+    (["자재명", "자재설명"], "자재명")
+]
+
+# 대시보드에서 실제로 사용하는 컬럼 (표준화된 이름 기준) - 나머지는 CSV 파싱 단계에서 제외
+USED_COLUMNS = ["마감월", "송장수량", "송장금액", "단가", "플랜트", "구매그룹",
+                "공급업체명", "공급업체코드", "자재", "자재명"]
+
+
+# 전처리된 DataFrame을 저장하는 Parquet 캐시 위치 (PURCHASE_DASHBOARD_CACHE_DIR 환경변수로 변경, 기본은 시스템 임시 폴더의 사용자별 폴더)
+# 업로드 데이터가 그대로 저장되므로 폴더는 본인만 접근 가능(0700)해야 하며, 그렇지 않으면 디스크 캐시를 사용하지 않음
+# 전처리 로직이 바뀌면 버전을 올려 이전 캐시를 무효화 (이전 버전 파일은 다음 캐시 기록 시 삭제)
+PARQUET_CACHE_DIR = os.environ.get(
+    "PURCHASE_DASHBOARD_CACHE_DIR",
+    os.path.join(
+        tempfile.gettempdir(),
+        f"purchase_dashboard_cache_{os.getuid()}" if hasattr(os, "getuid") else "purchase_dashboard_cache",
+    ),
+)
+PARQUET_CACHE_VERSION = 4
+# 디스크 캐시 보관 한도 - 파일 수나 전체 용량을 넘으면 가장 오래 사용하지 않은 파일부터 삭제
+PARQUET_CACHE_MAX_FILES = 20
+PARQUET_CACHE_MAX_BYTES = 1 << 30
+PARQUET_CACHE_FILE_RE = re.compile(r"^[0-9a-f]{64}_v(\d+)\.parquet$")
+
+
+# 업로드별 메모리 캐시(DuckDB 연결 등) 보관 한도 - 재업로드/동시 세션이 늘어도 오래된 업로드부터 해제
+UPLOAD_CACHE_MAX_ENTRIES = 4
+UPLOAD_CACHE_TTL = "2h"
+
+
+# 추이 차트 스펙에 포함할 수 있는 최대 행 수 - Altair 기본값(5000)은 플랜트+업체별 장기간 조회 시 부족하므로 상향하되,
+# 스펙에 JSON으로 포함되는 데이터가 무한정 커지지 않도록 한도는 유지 (전역 설정이므로 한 번만 지정)
+TREND_CHART_MAX_ROWS = 20_000
+alt.data_transformers.enable("default", max_rows=TREND_CHART_MAX_ROWS)
+
+
+# 자재 검색 결과 상세 테이블의 페이지당 행 수
+SEARCH_PAGE_SIZE = 500
+
+# 검색어가 이 개수 이상이면 LIKE OR 조건 대신 하나의 정규식으로 합쳐 한 번에 평가 (소수일 때는 LIKE가 더 빠름)
+REGEX_MIN_TERMS = 12
+
+
+# 마감월 문자열 형식 후보 (첫 번째 유효값으로 추정)
+DATE_FORMATS = ["%Y-%m-%d", "%Y-%m", "%Y.%m.%d", "%Y.%m", "%Y/%m/%d", "%Y/%m", "%Y%m%d", "%Y%m"]
+
+
+def _infer_date_format(values: pd.Series) -> Optional[str]:
+    """마감월 문자열 형식 추정 - 추정 불가 시 None (pandas 범용 파서 사용)"""
+    sample = values.dropna()
+    if sample.empty or not isinstance(sample.iloc[0], str):
+        return None
+    first = sample.iloc[0].strip()
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(first, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+
+def _normalize_column_name(col: str) -> str:
+    """컬럼명 비교용 정규화 - 공백과 괄호 제거"""
+    return col.replace(" ", "").replace("(", "").replace(")", "").strip()
+
+
+# 정규화된 변형 이름 -> 표준 컬럼명 사전 (컬럼마다 매핑 목록을 순회하지 않도록 미리 구성)
+COLUMN_LOOKUP: dict[str, str] = {
+    _normalize_column_name(var): target_name
+    for variations, target_name in COLUMN_MAPPINGS
+    for var in variations
+}
+
+
+def _standard_column_name(col: str) -> str:
+    """원본 컬럼명을 표준 컬럼명으로 변환 (매칭되는 변형이 없으면 원본 유지)"""
+    return COLUMN_LOOKUP.get(_normalize_column_name(col), col)
+
+
 def _standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df.columns = df.columns.str.strip()
-    rename_map: dict[str, str] = {}
-    
-    # 향상된 컬럼 매핑 로직 - 각 변형들을 개별적으로 처리
-    column_mappings = [
-        # 공급업체 관련
-        (["업체명", "공급업체명", "밤더명"], "공급업체명"),
-        (["공급업체", "공급사코드", "공급업체코드", "밤더코드"], "공급업체코드"),
-        # 구매그룹 관련
-        (["구매그룹명", "구매그룹"], "구매그룹"),
-        # 송장 관련
-        (["송장금액", "인보이스금액", "발주금액"], "송장금액"),
-        (["송장수량", "인보이스수량", "발주수량"], "송장수량"),
-        # 자재 관련
-        (["자재", "자재코드", "자재번호"], "자재"),
-        (["자재명", "자재설명"], "자재명")
-    ]
-    
-    for col in df.columns:
-        norm = col.replace(" ", "").replace("(", "").replace(")", "").strip()
-        
-        # 각 매핑 그룹을 확인하여 매칭되는 컬럼 찾기
-        for variations, target_name in column_mappings:
-            if any(norm == var.replace(" ", "") for var in variations):
-                rename_map[col] = target_name
-                break
-    
-    df = df.rename(columns=rename_map)
-    if df.columns.duplicated().any():
-        df = df.loc[:, ~df.columns.duplicated()]
+    columns = df.columns.str.strip()
+    # 컬럼 인덱스 전체를 한 번에 정규화하고 사전 조회 (매칭 없으면 원본 이름 유지)
+    norm = columns.str.replace(" ", "", regex=False).str.replace("(", "", regex=False).str.replace(")", "", regex=False)
+    df.columns = norm.map(COLUMN_LOOKUP).where(norm.isin(COLUMN_LOOKUP.keys()), columns)
+    # 중복 컬럼 마스크는 한 번만 계산하고, 중복이 있을 때만 컬럼 선택(복사) 수행
+    dup_mask = df.columns.duplicated()
+    if dup_mask.any():
+        df = df.iloc[:, ~dup_mask]
     return df
 
 
-@st.cache_data(show_spinner=False)
-def load_csv(upload: BytesIO) -> pd.DataFrame:
-    df = pd.read_csv(upload, encoding="cp949", low_memory=False)
-    
-    
+def _parquet_cache_dir_ready() -> bool:
+    """Parquet 캐시 폴더 준비 - 현재 사용자 소유이고 다른 사용자 권한이 없는 실제 폴더일 때만 사용"""
+    try:
+        os.makedirs(PARQUET_CACHE_DIR, mode=0o700, exist_ok=True)
+        info = os.lstat(PARQUET_CACHE_DIR)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(info.st_mode):
+        return False  # 심볼릭 링크 등으로 바꿔치기된 경로는 사용하지 않음
+    if not hasattr(os, "getuid"):
+        return True  # Windows는 사용자별 임시 폴더의 ACL에 맡김
+    return info.st_uid == os.getuid() and info.st_mode & 0o077 == 0
+
+
+def _prune_parquet_cache() -> None:
+    """Parquet 캐시 정리 - 이전 버전 파일은 삭제하고, 보관 한도를 넘으면 오래 사용하지 않은 파일부터 삭제"""
+    current = []
+    for entry in os.scandir(PARQUET_CACHE_DIR):
+        # 이 앱이 만든 캐시 파일만 대상으로 함 (임시 파일/다른 파일은 건드리지 않음)
+        match = PARQUET_CACHE_FILE_RE.match(entry.name)
+        if not match or not entry.is_file():
+            continue
+        if int(match.group(1)) != PARQUET_CACHE_VERSION:
+            os.remove(entry.path)
+        else:
+            stat = entry.stat()
+            current.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = 0
+    for count, (_, size, path) in enumerate(sorted(current, reverse=True), start=1):
+        total_bytes += size
+        if count > PARQUET_CACHE_MAX_FILES or total_bytes > PARQUET_CACHE_MAX_BYTES:
+            os.remove(path)
+
+
+def upload_content_key(uploaded_file) -> str:
+    """업로드 내용의 SHA-256 - 업로드(file_id)당 한 번만 계산하여 세션 상태에 보관 (같은 파일 재업로드 시 캐시 공유)"""
+    cached = st.session_state.get("upload_content_key")
+    if cached is None or cached[0] != uploaded_file.file_id:
+        cached = (uploaded_file.file_id, hashlib.sha256(uploaded_file.getvalue()).hexdigest())
+        st.session_state.upload_content_key = cached
+    return cached[1]
+
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def load_csv(content_key: str, _file_bytes: bytes) -> pd.DataFrame:
+    # 업로드 내용 해시 기준으로 캐시 - 바이트는 해시 대상에서 제외하여 rerun마다 수십 MB를 다시 해시하지 않고,
+    # 같은 파일을 다시 올리거나 다른 세션에서 올려도 메모리에는 한 벌만 보관
+    # 같은 파일을 이전에 처리한 적이 있으면 (앱 재시작 후에도) CSV 파싱 없이 Parquet 캐시에서 로드
+    cache_ready = _parquet_cache_dir_ready()
+    cache_path = os.path.join(PARQUET_CACHE_DIR, f"{content_key}_v{PARQUET_CACHE_VERSION}.parquet")
+    if cache_ready and os.path.exists(cache_path):
+        try:
+            os.utime(cache_path)  # 최근 사용 시각 갱신 (캐시 정리 시 LRU 기준)
+        except OSError:
+            pass
+        try:
+            return pd.read_parquet(cache_path, engine="pyarrow")
+        except (OSError, ValueError, pa.ArrowException):
+            # 다른 세션의 캐시 정리로 그 사이 삭제되었거나 손상된 파일이면 지우고 CSV에서 다시 생성
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+
+    # CP949 -> UTF-8 변환은 한 번만 수행하고, 파싱은 pyarrow 멀티스레드 리더에 맡김
+    text = _file_bytes.decode("cp949")
+    header = next(csv.reader(StringIO(text.split("\n", 1)[0])), [])
+    usecols = [c for c in header if _standard_column_name(c.strip()) in USED_COLUMNS]
+    table = pa_csv.read_csv(
+        BytesIO(text.encode("utf-8")),
+        read_options=pa_csv.ReadOptions(use_threads=True, block_size=16 << 20),
+        convert_options=pa_csv.ConvertOptions(include_columns=usecols, strings_can_be_null=True),
+    )
+    # pyarrow가 날짜로 인식한 컬럼은 datetime64로 바로 변환 (date 객체 배열 생성 방지), 변환 중 Arrow 버퍼는 즉시 해제
+    df = table.to_pandas(date_as_object=False, split_blocks=True, self_destruct=True)
+    del table
+
     df = _standardize_columns(df)
-    
-    
+
     if "마감월" not in df.columns:
         st.error(" '마감월' 컬럼을 찾을 수 없습니다. 헤더명을 확인해 주세요.")
         st.stop()
 
-    if pd.api.types.is_numeric_dtype(df["마감월"]):
+    if pd.api.types.is_datetime64_any_dtype(df["마감월"]):
+        pass  # CSV 리더 단계에서 이미 날짜로 파싱됨
+    elif pd.api.types.is_numeric_dtype(df["마감월"]):
         df["마감월"] = pd.to_datetime(df["마감월"], unit="D", origin="1899-12-30", errors="coerce")
     else:
-        df["마감월"] = pd.to_datetime(df["마감월"], errors="coerce")
-
-    df["연도"] = df["마감월"].dt.year.astype("Int64")
-    df["연월"] = df["마감월"].dt.to_period("M").dt.to_timestamp()
+        # 형식을 지정하면 범용 파서 대신 고정 형식 파서를 사용 (고유값 캐시로 같은 월 문자열은 한 번만 파싱)
+        date_format = _infer_date_format(df["마감월"])
+        parsed = pd.to_datetime(df["마감월"], format=date_format, errors="coerce", cache=True)
+        if date_format is not None:
+            # 다른 형식이 섞인 행만 범용 파서로 재시도
+            missed = parsed.isna() & df["마감월"].notna()
+            if missed.any():
+                parsed[missed] = pd.to_datetime(df.loc[missed, "마감월"], errors="coerce")
+        df["마감월"] = parsed
+
+    # PeriodArray를 거치지 않고 datetime64 단위 변환으로 월초 날짜와 연도를 바로 계산 (NaT는 결측으로 유지)
+    months = df["마감월"].to_numpy().astype("datetime64[M]")
+    missing_date = pd.isna(months)
+    df["연도"] = pd.arrays.IntegerArray(months.astype("datetime64[Y]").astype("int64") + 1970, missing_date)
+    df["연월"] = months.astype("datetime64[ns]")
 
     num_cols: List[str] = [c for c in ["송장수량", "송장금액", "단가", "플랜트", "구매그룹"] if c in df.columns]
-    
+
     if num_cols:
         for col in num_cols:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+            # pyarrow 리더가 이미 숫자형으로 읽은 컬럼은 변환을 건너뛰고, 결측치가 있을 때만 채움
+            if not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+            if df[col].hasnans:
+                df[col] = df[col].fillna(0)
+
+    # 숫자 컬럼을 가장 좁은 타입으로 축소하여 집계 시 메모리 대역폭 절감
+    for col in ["플랜트", "구매그룹"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    if "송장수량" in df.columns:
+        df["송장수량"] = pd.to_numeric(df["송장수량"], downcast="unsigned")
+    # 송장금액은 원 단위 소수점이 없는 경우에만 정수형으로 변환 (int32 범위면 int32로 축소하여 SUM 스캔량 절반)
+    if "송장금액" in df.columns and (df["송장금액"] % 1 == 0).all():
+        df["송장금액"] = pd.to_numeric(df["송장금액"].astype("int64"), downcast="integer")
 
     if "공급업체명" in df.columns:
         df["공급업체명"] = df["공급업체명"].astype(str).str.strip()
     if "공급업체코드" in df.columns:
-        # 공급업체코드 안전하게 처리 - 문자열 기반으로 소수점만 제거
-        def clean_supplier_code(x):
-            if pd.isna(x) or str(x).lower() in ['nan', 'none', ''] or str(x).strip() == '':
-                return ""
-            
-            str_val = str(x).strip()
-            
-            # .0으로 끝나는 경우만 제거 (예: "123.0" -> "123")
-            if str_val.endswith('.0'):
-                return str_val[:-2]
-            # .00으로 끝나는 경우도 제거 (예: "123.00" -> "123") 
-            elif str_val.endswith('.00'):
-                return str_val[:-3]
-            # 그 외에는 원본 유지
-            else:
-                return str_val
-        
-        df["공급업체코드"] = df["공급업체코드"].apply(clean_supplier_code)
-        # 공급업체코드가 있는 경우만 업체표시 생성
-        df["업체표시"] = df.apply(
-            lambda row: (
-                str(row["공급업체코드"]) + "_" + str(row["공급업체명"]).strip()
-                if row["공급업체코드"] and str(row["공급업체명"]).strip() and str(row["공급업체명"]) != "nan"
-                else str(row["공급업체명"]).strip() if str(row["공급업체명"]) != "nan" else ""
-            ), axis=1
-        )
+        # 공급업체코드 안전하게 처리 - 문자열 기반으로 소수점만 제거 (행 단위 apply 대신 str 접근자로 일괄 처리)
+        raw_code = df["공급업체코드"]
+        code_str = raw_code.astype(str)
+        stripped = code_str.str.strip()
+        # 결측/'nan'/'none'/공백은 빈 문자열로 처리
+        is_blank = raw_code.isna() | code_str.str.lower().isin(["nan", "none", ""]) | (stripped == "")
+        # .0 / .00으로 끝나는 경우만 제거 (예: "123.0" -> "123", "123.00" -> "123"), 그 외에는 원본 유지
+        df["공급업체코드"] = stripped.str.replace(r"\.0{1,2}$", "", regex=True).mask(is_blank, "")
+        # 업체표시: 코드와 업체명이 모두 있으면 "코드_업체명", 아니면 업체명 (행 단위 apply 대신 Arrow 문자열 커널로 일괄 처리)
+        code = pa.array(df["공급업체코드"], type=pa.string())
+        name = pc.fill_null(pa.array(df["공급업체명"].mask(df["공급업체명"] == "nan", ""), type=pa.string()), "")
+        has_both = pc.and_(pc.not_equal(code, ""), pc.not_equal(name, ""))
+        label = pc.if_else(has_both, pc.binary_join_element_wise(code, name, "_"), name)
+        df["업체표시"] = pd.Series(label.to_pandas(), index=df.index)
     elif "공급업체명" in df.columns:
         df["업체표시"] = df["공급업체명"]
 
+    # 반복값이 많은 문자열 컬럼은 범주형으로 저장 (정수 코드 배열 + 작은 사전)
+    for col in ["공급업체명", "공급업체코드", "자재명", "업체표시"]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    if cache_ready:
+        try:
+            # 임시 파일에 쓴 뒤 교체하여 중간에 중단되어도 깨진 캐시가 남지 않도록 함 (파일은 본인만 읽기/쓰기 가능하게 생성)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as tmp_file:
+                df.to_parquet(tmp_file, engine="pyarrow", compression="zstd", index=False)
+            os.replace(tmp_path, cache_path)
+            _prune_parquet_cache()
+        except (OSError, ValueError, pa.ArrowException):
+            pass  # 읽기 전용 환경이나 Parquet로 저장할 수 없는 컬럼이 있으면 캐시 없이 동작
+
     return df
 
 
-def sql_list_num(vals: list[int]) -> str:
-    return ",".join(map(str, vals)) if vals else "-1"
+@st.cache_resource(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def get_connection(content_key: str, _df: pd.DataFrame) -> duckdb.DuckDBPyConnection:
+    """업로드 파일별 DuckDB 연결 - rerun 간 재사용 (테이블로 적재하여 컬럼 통계 유지)"""
+    con = duckdb.connect(database=":memory:")
+    con.register("raw_data", _df)
+    # 자재 검색용 소문자 컬럼을 미리 만들어 두어 검색 시 행마다 CAST/대소문자 변환을 하지 않도록 함
+    search_cols = ""
+    if "자재명" in _df.columns:
+        search_cols += ", lower(CAST(자재명 AS VARCHAR)) AS 자재명_검색"
+    if "자재" in _df.columns:
+        search_cols += ", lower(CAST(자재 AS VARCHAR)) AS 자재코드_검색"
+    con.execute(f"CREATE TABLE data AS SELECT *{search_cols} FROM raw_data")
+    if "자재명" in _df.columns:
+        # 자재명은 반복이 많으므로 고유값 사전을 만들어 두고 LIKE 검색은 사전에서만 수행
+        con.execute("CREATE TABLE material_names AS SELECT DISTINCT 자재명, 자재명_검색 FROM data WHERE 자재명 IS NOT NULL")
+    # 월 x 플랜트 x 구매그룹 x 업체 단위로 미리 합산한 큐브 - 자재 조건이 없는 집계/옵션 조회는 원본 대신 이 테이블을 스캔
+    # (마감월은 월초 날짜로 두어 연월 필터 조건을 원본 테이블과 동일하게 적용할 수 있도록 함)
+    cube_keys = ["연월 AS 마감월", "연월", "연도"] + [c for c in ["플랜트", "구매그룹", "공급업체코드", "공급업체명"] if c in _df.columns]
+    con.execute(f"""
+        CREATE TABLE monthly_cube AS
+        SELECT {', '.join(cube_keys)}, SUM(송장수량) AS 송장수량, SUM(송장금액) AS 송장금액
+        FROM data
+        GROUP BY ALL
+    """)
+    if "업체표시" in _df.columns:
+        # '전체 공급업체' 선택 시 전체 옵션 목록을 매번 바인딩하지 않도록 전체 선택에 해당하는 필터 값을 미리 테이블로 보관
+        supplier_col = "공급업체코드" if "공급업체코드" in _df.columns else "공급업체명"
+        con.register("all_supplier_values", pd.DataFrame(
+            {supplier_col: supplier_filter_values(_supplier_options(_df["업체표시"]), supplier_col)}
+        ))
+        con.execute("CREATE TABLE all_suppliers AS SELECT DISTINCT * FROM all_supplier_values")
+        con.unregister("all_supplier_values")
+    con.unregister("raw_data")
+    return con
+
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def get_filter_options(content_key: str, _df: pd.DataFrame) -> dict[str, list]:
+    """사이드바 필터 옵션 목록 - rerun마다 전체 컬럼을 다시 스캔하지 않도록 파일별로 캐시"""
+    return {
+        # 연월은 이미 월초로 정규화되어 있으므로 고유값만 먼저 뽑은 뒤 문자열로 변환 (행 단위 strftime 방지)
+        "yearmonths": pd.DatetimeIndex(_df["연월"].dropna().unique()).sort_values().strftime('%Y-%m').tolist(),
+        "plants": sorted([x for x in _df["플랜트"].dropna().astype(int).unique() if x > 0]) if "플랜트" in _df.columns else [],
+        "groups": sorted([x for x in _df["구매그룹"].dropna().astype(int).unique() if x > 0]) if "구매그룹" in _df.columns else [],
+        "suppliers": _supplier_options(_df["업체표시"]) if "업체표시" in _df.columns else [],
+    }
 
 
-def sql_list_str(vals: list[str]) -> str:
-    if not vals:
-        return "''"
-    # 안전한 문자열 이스케이프 - 한글/특수문자 포함
-    safe_vals = []
-    for v in vals:
-        if v is None:
-            continue
-        # 문자열로 변환 후 안전하게 이스케이프
-        v_str = str(v).strip()
-        if v_str:  # 빈 문자열이 아닌 경우만 추가
-            # SQL 이스케이프: 작은따옴표 이중화
-            escaped = v_str.replace("'", "''")
-            safe_vals.append(f"'{escaped}'")
-    return ",".join(safe_vals) if safe_vals else "''"
-
-
-def format_numeric_columns(df: pd.DataFrame, numeric_cols: list[str]) -> pd.DataFrame:
-    """숫자 컬럼에 천단위 콤마 적용"""
-    df_formatted = df.copy()
-    for col in numeric_cols:
-        if col in df_formatted.columns:
-            df_formatted[col] = df_formatted[col].apply(
-                lambda x: f"{x:,.1f}" if pd.notnull(x) and isinstance(x, (int, float)) else str(x)
+def _supplier_options(labels: pd.Series) -> list[str]:
+    """업체표시 필터 옵션 - 빈 값/'nan' 포함/'0_' 시작 항목 제외 (행 단위 루프 대신 str 접근자로 일괄 처리)"""
+    # 범주형 컬럼은 이미 정렬된 고유값(categories)을 가지고 있으므로 전체 스캔 불필요
+    cats = labels.cat.categories.astype(str)
+    keep = (cats.str.strip() != '') & ~cats.str.lower().str.contains('nan', regex=False) & ~cats.str.startswith('0_')
+    return cats[keep].tolist()
+
+
+def supplier_filter_values(labels: list[str], supplier_col: str) -> list[str]:
+    """업체표시 목록을 필터 컬럼 값으로 변환 - 공급업체코드는 유효한 코드만, 공급업체명은 공백 제외"""
+    values = []
+    for s in labels:
+        if supplier_col == "공급업체코드":
+            value = s.split("_", 1)[0] if "_" in s else s
+            if value and value != "0":  # 유효한 코드만 추가
+                values.append(value)
+        else:
+            value = (s.split("_", 1)[1] if "_" in s else s).strip()
+            if value:
+                values.append(value)
+    return values
+
+
+def supplier_clause(sel_suppliers: list[str], suppliers_all: list[str], supplier_col: str, params: list) -> Optional[str]:
+    """공급업체 필터 조건 - 전체 선택이면 미리 만든 all_suppliers 테이블과 세미조인하고, 일부 선택일 때만 목록을 바인딩"""
+    if len(sel_suppliers) == len(suppliers_all):
+        return f"{supplier_col} IN (SELECT {supplier_col} FROM all_suppliers)"
+    values = supplier_filter_values(sel_suppliers, supplier_col)
+    if not values:
+        return None
+    params.append(values)
+    return f"{supplier_col} IN (SELECT unnest(?))"
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_query(content_key: str, sql: str, params: list, _con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+    """필터 조합(SQL + 파라미터)별 집계 결과 캐시 - 필터와 무관한 위젯 변경으로 rerun 될 때 재실행 방지"""
+    return _con.execute(sql, params).fetchdf()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def search_csv_bytes(content_key: str, sql: str, params: list, _con: duckdb.DuckDBPyConnection) -> bytes:
+    """검색 조건(SQL + 파라미터)별 전체 검색결과 CSV 캐시 - 다운로드 클릭으로 rerun 될 때 전체 조회 재실행 방지"""
+    return arrow_to_csv_bytes(_con.execute(sql, params).arrow())
+
+
+@st.cache_data(show_spinner=False)
+def build_trend_chart_spec(time_df: pd.DataFrame, time_unit: str, time_name: str, time_format: str,
+                           group_option: str, group_col: str, is_combined: bool, metric_name: str,
+                           y_title: str, unit_text: str) -> dict:
+    """추이 차트 Vega-Lite 스펙 생성 - 집계 결과와 표시 옵션이 같으면 rerun 시 스펙을 다시 만들지 않도록 캐시"""
+    # 차트 생성 - 클릭 이벤트 추가
+    click = alt.selection_point(name="point_select")
+
+    # X축 설정 개선 - 중복 방지 및 정렬
+    if time_unit == "월별":
+        # 월별 차트의 경우 시간을 정확히 처리하고 중복 방지
+        unique_months = sorted(time_df[time_name].unique())
+
+        x_encoding = alt.X(
+            f"{time_name}:T", 
+            title=time_unit, 
+            axis=alt.Axis(
+                format=time_format, 
+                labelAngle=-45,
+                labelOverlap=False,
+                labelSeparation=15,
+                values=unique_months,  # 정확한 월 값들만 표시
+                offset=10  # X축을 아래로 이동하여 Y축과 거리 확보
+            ),
+            sort="ascending",
+            scale=alt.Scale(
+                type="time",
+                nice=False,
+                domain=unique_months,  # 도메인을 정확한 월들로 제한
+                padding=0.2,  # X축 양쪽 여백을 20%로 증가
+                range=[50, {"expr": "width-50"}]  # 실제 차트 영역을 왼쪽 50px, 오른쪽 50px 안쪽으로 제한
+            )
+        )
+    else:
+        # 연도별의 경우
+        unique_years = sorted(time_df[time_name].unique())
+        x_encoding = alt.X(
+            f"{time_name}:O", 
+            title=time_unit,
+            axis=alt.Axis(offset=10),  # X축을 아래로 이동
+            sort="ascending",
+            scale=alt.Scale(
+                domain=unique_years,  # 도메인 명시적 지정
+                padding=0.2,  # X축 양쪽 여백을 20%로 증가
+                range=[50, {"expr": "width-50"}]  # 실제 차트 영역을 왼쪽 50px, 오른쪽 50px 안쪽으로 제한
             )
-    return df_formatted
+        )
+
+    # 복합 차트 생성 함수 (이중축) - 누적막대 + 심미적 개선
+    def create_combined_chart(data, group_col_name=None):
+        # 데이터 포인트 수에 따른 동적 막대 두께 계산
+        data_points = len(data[time_name].unique()) if not data.empty else 1
+        # 2개월이면 두껍게, 12개월이면 적당하게
+        bar_size = max(15, min(60, 120 - data_points * 5))
+
+        # 차트 속성 정의 - padding은 LayerChart에서 적용
+        chart_props = {
+            "height": 600,  # 고정 높이
+            "width": max(400, data_points * 80)  # 최소 400px, 데이터 포인트당 80px
+        }
+
+        # 툴팁 설정
+        tooltip_cols = ["시간표시:N", "송장금액_백만원:Q", "송장수량_천EA:Q"]
+        if group_col_name:
+            tooltip_cols.insert(1, f"{group_col_name}:N")
+
+        # **누적 막대를 위한 축 범위 계산 개선**
+        if group_col_name:
+            # 그룹별 데이터인 경우 시간별 누적값 계산
+            stacked_amounts = data.groupby(time_name)['송장금액_백만원'].sum()
+            max_stacked_amount = stacked_amounts.max() if not stacked_amounts.empty else 100
+        else:
+            # 전체 데이터인 경우
+            max_stacked_amount = data['송장금액_백만원'].max() if not data.empty else 100
+
+        # 송장수량 범위 계산 (꺾은선을 누적막대 상단에 배치) - 개선된 축 설정
+        non_zero_quantities = data[data['송장수량_천EA'] > 0]['송장수량_천EA']
+        if not non_zero_quantities.empty:
+            max_quantity = non_zero_quantities.max()
+            # 최댓값을 10단위로 반올림 (깔끔한 축 표시)
+            import math
+            max_quantity_rounded = math.ceil(max_quantity / 10) * 10
+
+            # 누적막대 최대값의 120% 지점을 꺾은선 시작점으로 설정
+            line_start_point = max_stacked_amount * 1.2
+            # 송장수량의 전체 범위를 상단 영역에 배치
+            line_height = max_stacked_amount * 0.6  # 누적막대 높이의 60%를 꺾은선 영역으로
+            min_quantity = 0  # 최솟값을 0으로 고정
+
+            # 0부터 반올림된 최댓값까지의 범위를 line_height에 매핑
+            expanded_max_quantity = line_start_point + line_height
+
+            # 데이터 변환을 위한 스케일링 팩터 계산 (0~max_quantity_rounded를 line_start_point~expanded_max_quantity로 변환)
+            if max_quantity_rounded > 0:
+                quantity_scale_factor = line_height / max_quantity_rounded
+                quantity_offset = line_start_point
+            else:
+                quantity_scale_factor = 1
+                quantity_offset = line_start_point
+        else:
+            max_quantity_rounded = 50
+            line_start_point = max_stacked_amount * 1.2
+            min_quantity = 0  # 최솟값을 0으로 고정
+            line_height = max_stacked_amount * 0.6
+            expanded_max_quantity = line_start_point + line_height
+            quantity_scale_factor = line_height / max_quantity_rounded
+            quantity_offset = line_start_point
+
+        # 송장금액 범위는 누적값 기준으로 설정
+        expanded_max_amount = max_stacked_amount * 1.5  # 20% 여유공간
+
+        # 송장수량 데이터를 상단 영역으로 변환 - 데이터프레임 복사 대신 Vega-Lite 계산 변환으로 브라우저에서 처리
+        quantity_transform = {'송장수량_변환': f"datum['송장수량_천EA'] * {quantity_scale_factor} + {quantity_offset}"}
+
+        # **누적 막대차트** - 왼쪽 축만 표시
+        if group_col_name:
+            # 그룹별 누적 막대차트
+            left_chart = alt.Chart(data).mark_bar(opacity=0.8, size=bar_size).encode(
+                x=x_encoding,
+                y=alt.Y('송장금액_백만원:Q', 
+                       title='송장금액(백만원)', 
+                       axis=alt.Axis(
+                           orient='left', 
+                           titleColor='steelblue', 
+                           grid=True,
+                           labelColor='steelblue',
+                           tickColor='steelblue',
+                           labelPadding=15,
+                           titlePadding=20,
+                           offset=5
+                       ),
+                       scale=alt.Scale(domain=[0, expanded_max_amount]),
+                       stack='zero'),  # **누적 설정**
+                color=alt.Color(f"{group_col_name}:N", 
+                               legend=alt.Legend(title=group_col_name, orient='right')),
+                tooltip=tooltip_cols,
+                order=alt.Order(f"{group_col_name}:N", sort='ascending')  # 누적 순서 일관성
+            ).properties(**chart_props)
+        else:
+            # 전체 데이터 막대차트 (누적 없음)
+            left_chart = alt.Chart(data).mark_bar(opacity=0.7, size=bar_size).encode(
+                x=x_encoding,
+                y=alt.Y('송장금액_백만원:Q', 
+                       title='송장금액(백만원)', 
+                       axis=alt.Axis(
+                           orient='left', 
+                           titleColor='steelblue', 
+                           grid=True,
+                           labelColor='steelblue',
+                           tickColor='steelblue',
+                           labelPadding=15,
+                           titlePadding=20,
+                           offset=5
+                       ),
+                       scale=alt.Scale(domain=[0, expanded_max_amount])),
+                color=alt.value('steelblue'),
+                tooltip=tooltip_cols
+            ).properties(**chart_props)
+
+        # **꺾은선 차트** - 오른쪽 축만 표시, 확장된 Y축 범위
+        if group_col_name:
+            # 그룹별 꺾은선차트
+            right_chart = alt.Chart(data).transform_calculate(**quantity_transform).mark_line(
+                point=alt.OverlayMarkDef(size=100, filled=True), 
+                strokeWidth=4
+            ).encode(
+                x=x_encoding,
+                y=alt.Y('송장수량_변환:Q', 
+                       title='송장수량(천EA)', 
+                       axis=alt.Axis(
+                           orient='right', 
+                           titleColor='red', 
+                           grid=False,
+                           labelColor='red',
+                           tickColor='red',
+                           labelPadding=15,
+                           titlePadding=20,
+                           offset=5,
+                           labelExpr=f'max(0, round((datum.value - {quantity_offset}) / {quantity_scale_factor}))'
+                       ),
+                       # **상단 영역으로 변환된 데이터 범위**
+                       scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
+                color=alt.Color(f"{group_col_name}:N"),
+                tooltip=tooltip_cols
+            ).properties(**chart_props)
+        else:
+            # 전체 데이터 꺾은선차트
+            right_chart = alt.Chart(data).transform_calculate(**quantity_transform).mark_line(
+                point=alt.OverlayMarkDef(size=100, filled=True), 
+                strokeWidth=4
+            ).encode(
+                x=x_encoding,
+                y=alt.Y('송장수량_변환:Q', 
+                       title='송장수량(천EA)', 
+                       axis=alt.Axis(
+                           orient='right', 
+                           titleColor='red', 
+                           grid=False,
+                           labelColor='red',
+                           tickColor='red',
+                           labelPadding=15,
+                           titlePadding=20,
+                           offset=5,
+                           labelExpr=f'max(0, round((datum.value - {quantity_offset}) / {quantity_scale_factor}))'
+                       ),
+                       # **상단 영역으로 변환된 데이터 범위**
+                       scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
+                color=alt.value('red'),
+                tooltip=tooltip_cols
+            ).properties(**chart_props)
+
+        # **데이터 레이블 개선**
+        if group_col_name:
+            # 누적 막대의 각 세그먼트에 레이블 표시 - 정확한 중점 계산
+            # 먼저 누적 데이터의 중점을 계산하기 위해 데이터를 변환
+            # 필요한 컬럼만 골라 정렬 (정렬 결과가 새 프레임이므로 전체 복사 불필요)
+            segment_data = data[[time_name, group_col_name, '송장금액_백만원']].sort_values(
+                [time_name, group_col_name], kind='mergesort'
+            )
+
+            # 각 시점별 누적합에서 세그먼트 절반을 빼서 중점 위치 계산 (행 단위 반복 대신 groupby 누적합으로 일괄 처리)
+            cumsum = segment_data.groupby(time_name, sort=False)['송장금액_백만원'].cumsum()
+            segment_data['mid_y'] = cumsum - segment_data['송장금액_백만원'] / 2
+            mid_point_df = segment_data[[time_name, group_col_name, '송장금액_백만원', 'mid_y']].reset_index(drop=True)
+
+            segment_text = alt.Chart(mid_point_df).mark_text(
+                dy=0, fontSize=9, fontWeight='bold', color='white'
+            ).encode(
+                x=x_encoding,
+                y=alt.Y('mid_y:Q', 
+                       axis=None,
+                       scale=alt.Scale(domain=[0, expanded_max_amount])),
+                text=alt.condition(
+                    alt.datum.송장금액_백만원 >= 20,  # 20 이상인 경우만 표시 (가독성 개선)
+                    alt.Text('송장금액_백만원:Q', format='.0f'),
+                    alt.value('')
+                ),
+                order=alt.Order(f"{group_col_name}:N", sort='ascending')
+            ).properties(**chart_props)
+
+            # 전체 누적값도 상단에 표시
+            # 축 범위 계산에서 구한 시간별 누적값을 재사용 (시간 컬럼은 이미 날짜형이므로 재변환 불필요)
+            stacked_totals = stacked_amounts.reset_index()
+
+            bar_text = alt.Chart(stacked_totals).mark_text(
+                dy=-8, fontSize=10, fontWeight='bold', color='steelblue'
+            ).encode(
+                x=x_encoding.copy(),
+                y=alt.Y('송장금액_백만원:Q', 
+                       axis=None,
+                       scale=alt.Scale(domain=[0, expanded_max_amount])),
+                text=alt.condition(
+                    alt.datum.송장금액_백만원 > 0,
+                    alt.Text('송장금액_백만원:Q', format='.0f'),
+                    alt.value('')
+                )
+            ).properties(**chart_props)
+        else:
+            # 전체 데이터 막대 레이블
+            bar_text = alt.Chart(data).mark_text(dy=-8, fontSize=10, fontWeight='bold').encode(
+                x=x_encoding,
+                y=alt.Y('송장금액_백만원:Q', 
+                       axis=None,
+                       scale=alt.Scale(domain=[0, expanded_max_amount])),
+                text=alt.condition(
+                    alt.datum.송장금액_백만원 > 0,
+                    alt.Text('송장금액_백만원:Q', format='.0f'),
+                    alt.value('')
+                ),
+                color=alt.value('black')
+            ).properties(**chart_props)
+
+        # 꺾은선 차트 데이터 레이블 - 개선된 위치
+        if group_col_name:
+            line_text = alt.Chart(data).transform_calculate(**quantity_transform).mark_text(
+                dy=-15, fontSize=9, fontWeight='bold'
+            ).encode(
+                x=x_encoding,
+                y=alt.Y('송장수량_변환:Q', 
+                       axis=None,
+                       scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
+                text=alt.condition(
+                    alt.datum.송장수량_천EA > 0,
+                    alt.Text('송장수량_천EA:Q', format='.0f'),
+                    alt.value('')
+                ),
+                color=alt.Color(f"{group_col_name}:N")
+            ).properties(**chart_props)
+        else:
+            line_text = alt.Chart(data).transform_calculate(**quantity_transform).mark_text(
+                dy=-15, fontSize=9, fontWeight='bold'
+            ).encode(
+                x=x_encoding,
+                y=alt.Y('송장수량_변환:Q', 
+                       axis=None,
+                       scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
+                text=alt.condition(
+                    alt.datum.송장수량_천EA > 0,
+                    alt.Text('송장수량_천EA:Q', format='.0f'),
+                    alt.value('')
+                ),
+                color=alt.value('red')
+            ).properties(**chart_props)
+
+        # **완전한 이중축 차트 - 각 축이 독립적으로 표시**
+        if group_col_name:
+            combined_chart = alt.layer(
+                left_chart,    # 누적 막대차트 (왼쪽 축)
+                right_chart,   # 꺾은선차트 (오른쪽 축, 확장된 범위)
+                segment_text,  # 누적 막대 세그먼트 레이블
+                bar_text,      # 막대차트 총합 레이블
+                line_text      # 꺾은선차트 레이블
+            ).resolve_scale(y='independent').properties(
+                title=f"구매 데이터 추이 - {unit_text}",
+                padding={"left": 100, "top": 40, "right": 100, "bottom": 50}
+            )
+        else:
+            combined_chart = alt.layer(
+                left_chart,   # 일반 막대차트 (왼쪽 축)
+                right_chart,  # 꺾은선차트 (오른쪽 축, 확장된 범위)
+                bar_text,     # 막대차트 레이블
+                line_text     # 꺾은선차트 레이블
+            ).resolve_scale(y='independent').properties(
+                title=f"구매 데이터 추이 - {unit_text}",
+                padding={"left": 100, "top": 40, "right": 100, "bottom": 50}
+            )
+
+        return combined_chart.add_params(click)
+
+    if is_combined:
+        # 복합 차트 처리
+        if group_option == "전체":
+            chart = create_combined_chart(time_df)
+        elif group_option in ["플랜트+업체별", "파트+카테고리(최종)별", "파트+KPI용카테고리별"]:
+            chart = create_combined_chart(time_df, group_col)
+        else:
+            chart = create_combined_chart(time_df, group_col)
+    elif group_option == "전체":
+        base = alt.Chart(time_df)
+        line = base.mark_line(point=alt.OverlayMarkDef(size=100)).encode(
+            x=x_encoding,
+            y=alt.Y(f"{metric_name}:Q", title=y_title),
+            tooltip=["시간표시:N", f"{metric_name}:Q"]
+        )
+        text = base.mark_text(dy=-15, fontSize=11, fontWeight='bold', color='darkblue').encode(
+            x=x_encoding,
+            y=alt.Y(f"{metric_name}:Q"),
+            text=alt.condition(
+                f"datum.{metric_name} > 0",
+                alt.Text(f"{metric_name}:Q", format='.0f'),
+                alt.value('')
+            )
+        )
+        chart = (line + text).add_params(click)
+    elif group_option == "플랜트+업체별":
+        base = alt.Chart(time_df)
+        line = base.mark_line(point=True).encode(
+            x=x_encoding,
+            y=alt.Y(f"{metric_name}:Q", title=y_title),
+            color=alt.Color("플랜트_업체:N", title="플랜트_업체"),
+            tooltip=["시간표시:N", "플랜트:O", "공급업체명:N", f"{metric_name}:Q"]
+        )
+        text = base.mark_text(dy=-15, fontSize=9, fontWeight='bold').encode(
+            x=x_encoding,
+            y=alt.Y(f"{metric_name}:Q"),
+            text=alt.condition(
+                f"datum.{metric_name} > 0",
+                alt.Text(f"{metric_name}:Q", format='.0f'),
+                alt.value('')
+            ),
+            color=alt.Color("플랜트_업체:N")
+        )
+        chart = (line + text).add_params(click)
+    else:
+        base = alt.Chart(time_df)
+        line = base.mark_line(point=True).encode(
+            x=x_encoding,
+            y=alt.Y(f"{metric_name}:Q", title=y_title),
+            color=alt.Color(f"{group_col}:N", title=group_col),
+            tooltip=["시간표시:N", f"{group_col}:N", f"{metric_name}:Q"]
+        )
+        text = base.mark_text(dy=-15, fontSize=9, fontWeight='bold').encode(
+            x=x_encoding,
+            y=alt.Y(f"{metric_name}:Q"),
+            text=alt.condition(
+                f"datum.{metric_name} > 0",
+                alt.Text(f"{metric_name}:Q", format='.0f'),
+                alt.value('')
+            ),
+            color=alt.Color(f"{group_col}:N")
+        )
+        chart = (line + text).add_params(click)
+
+    spec = chart.to_dict()
+    # Altair 기본 테마의 config는 view 기본 크기(continuousWidth/Height 300)뿐이며, st.altair_chart도 이 크기 기본값이
+    # Streamlit에 맞지 않아 "none" 테마로 변환하므로 동일하게 제외 (색상/글꼴 등은 vega_lite_chart의 Streamlit 테마가 적용)
+    spec.pop("config", None)
+    return spec
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV 다운로드용 바이트 생성 - 엑셀 호환을 위해 UTF-8 BOM 포함, 바이트 버퍼에 바로 기록 (내용이 같으면 캐시 재사용)"""
+    buf = BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8-sig")
+    return buf.getvalue()
+
+
+def arrow_to_csv_bytes(data) -> bytes:
+    """Arrow Table/RecordBatchReader(DuckDB .arrow() 결과)를 배치 단위로 CSV 기록 - to_csv_bytes와 같은 pandas 서식 (UTF-8 BOM 포함)"""
+    batches = data.to_batches() if isinstance(data, pa.Table) else data
+    buf = BytesIO()
+    buf.write(codecs.BOM_UTF8)
+    header = True
+    for batch in batches:
+        batch.to_pandas().to_csv(buf, index=False, header=header, encoding="utf-8")
+        header = False
+    if header:
+        pd.DataFrame(columns=data.schema.names).to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
 
 
 def enhance_pattern(pattern: str) -> str:
-    """자재 검색 패턴 강화 함수"""
+    """자재 검색 패턴 강화 함수 (소문자 검색 컬럼과 LIKE로 비교하도록 소문자로 반환)"""
     if "*" not in pattern:
         if " " in pattern:
             # 띄어쓰기가 있으면 각 단어에 와일드카드 적용
@@ -301,7 +968,36 @@ def enhance_pattern(pattern: str) -> str:
         else:
             # 단일 단어도 양쪽에 와일드카드 추가
             pattern = "*" + pattern + "*"
-    return pattern.replace("*", "%").replace("'", "''")
+    return pattern.replace("*", "%").lower()
+
+
+def like_to_regex(pattern: str) -> str:
+    """LIKE 패턴(%, _)을 같은 의미의 정규식으로 변환 (앞뒤 %는 앵커 생략으로 처리)"""
+    regex = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern)
+    regex = regex[2:] if regex.startswith(".*") else "^" + regex
+    return regex[:-2] if regex.endswith(".*") else regex + "$"
+
+
+def search_terms_condition(column: str, terms: list[str], params: list) -> str:
+    """검색어 목록의 OR 조건 생성 - 검색어가 많으면 하나의 정규식으로 합쳐 검색어 수만큼 반복 평가하지 않도록 함"""
+    patterns = [enhance_pattern(term) for term in terms]
+    if len(patterns) < REGEX_MIN_TERMS:
+        params.extend(patterns)
+        return " OR ".join([f"{column} LIKE ?"] * len(patterns))
+    params.append("(?s)" + "|".join(f"(?:{like_to_regex(p)})" for p in patterns))
+    return f"regexp_matches({column}, ?)"
+
+
+def month_range_params(yearmonths: list[str]) -> list[datetime]:
+    """연속된 'YYYY-MM' 목록을 마감월 범위 조건(마감월 >= ? AND 마감월 < ?)의 파라미터로 변환"""
+    lo = pd.Timestamp(min(yearmonths) + "-01")
+    hi = pd.Timestamp(max(yearmonths) + "-01") + pd.offsets.MonthBegin(1)
+    return [lo.to_pydatetime(), hi.to_pydatetime()]
+
+
+def material_name_clause(name_condition: str) -> str:
+    """자재명 검색 조건을 고유 자재명 사전에서 먼저 평가하고 결과 이름으로만 필터링 (행마다 LIKE 평가 방지)"""
+    return f"자재명 IN (SELECT 자재명 FROM material_names WHERE {name_condition})"
 
 
 
@@ -322,16 +1018,20 @@ def multiselect_with_toggle(label: str, options: list, key_prefix: str) -> list:
         st.button("☑", on_click=_set_all, args=(ms_key, options), key=f"{key_prefix}_all", help="전체 선택")
     return sel
 
+def multiselect_with_all_checkbox(label: str, options: list, key_prefix: str) -> list:
+    """옵션이 많은 필터용 - '전체' 체크 시 목록 위젯을 렌더링하지 않고 전체 옵션을 반환"""
+    if st.checkbox(f"전체 {label}", value=True, key=f"{key_prefix}_all_cb"):
+        return options
+    return st.multiselect(label, options, key=f"{key_prefix}_ms")
+
 with st.sidebar:
     st.header("CSV 업로드")
     uploaded_file = st.file_uploader("CSV 파일 선택", type="csv", help="CP949 인코딩으로 저장된 CSV 파일")
 
 if uploaded_file:
     with st.spinner("CSV 불러오는 중..."):
-        if st.session_state.get("file_name") != uploaded_file.name:
-            st.session_state["df"] = load_csv(uploaded_file)
-            st.session_state["file_name"] = uploaded_file.name
-    df: Optional[pd.DataFrame] = st.session_state["df"]
+        upload_key = upload_content_key(uploaded_file)
+        df: Optional[pd.DataFrame] = load_csv(upload_key, uploaded_file.getvalue())
 else:
     st.info("먼저 CSV 파일을 업로드해 주세요.")
     with st.expander("파일 업로드 도움말", expanded=False):
@@ -358,17 +1058,17 @@ if df is not None and not df.empty:
         st.session_state.global_material_code_search = ""
     
     
-    con = duckdb.connect(database=":memory:")
-    con.register("data", df)
+    # 캐시된 연결을 공유하되, 세션별로 cursor를 사용하여 동시 실행 충돌 방지
+    con = get_connection(upload_key, df).cursor()
 
     with st.sidebar:
         st.header("필터 조건")
-        # 안전한 필터 옵션 생성
-        yearmonths_all = sorted(df["연월"].dropna().dt.strftime('%Y-%m').unique().tolist())
-        plants_all = sorted([x for x in df["플랜트"].dropna().astype(int).unique() if x > 0]) if "플랜트" in df.columns else []
-        groups_all = sorted([x for x in df["구매그룹"].dropna().astype(int).unique() if x > 0]) if "구매그룹" in df.columns else []
-        suppliers_all = sorted([x for x in df["업체표시"].dropna().unique()
-                                if str(x).strip() != '' and 'nan' not in str(x).lower() and not str(x).startswith('0_')]) if "업체표시" in df.columns else []
+        # 안전한 필터 옵션 생성 (업로드 파일별 캐시)
+        filter_options = get_filter_options(upload_key, df)
+        yearmonths_all = filter_options["yearmonths"]
+        plants_all = filter_options["plants"]
+        groups_all = filter_options["groups"]
+        suppliers_all = filter_options["suppliers"]
 
         # 연월 범위 선택
         st.subheader("기간 입력 (YYYY-MM)")
@@ -395,51 +1095,45 @@ if df is not None and not df.empty:
 
         sel_plants = multiselect_with_toggle("플랜트", plants_all, "pl") if plants_all else []
         sel_groups = multiselect_with_toggle("구매그룹", groups_all, "gr") if groups_all else []
-        sel_suppliers = multiselect_with_toggle("공급업체", suppliers_all, "sp") if suppliers_all else []
+        # 공급업체는 수천 개일 수 있으므로 기본은 '전체' 체크박스로 처리 (전체 목록 칩 렌더링/전송 방지)
+        sel_suppliers = multiselect_with_all_checkbox("공급업체", suppliers_all, "sp") if suppliers_all else []
         
         # 필터 초기화 버튼
         if st.button("🗑️ 모든 필터 초기화", key="clear_all_filters"):
             # 세션 상태 초기화 (자재 검색 제외, 하단에서 관리)
             for key in list(st.session_state.keys()):
-                if key.endswith("_ms"):
+                if key.endswith(("_ms", "_all_cb")):
                     del st.session_state[key]
             st.rerun()
 
-    # 연월 필터링을 위한 SQL 조건 생성
-    ym_conditions = []
-    for ym in sel_yearmonths:
-        year, month = ym.split('-')
-        ym_conditions.append(f"(EXTRACT(YEAR FROM 마감월) = {year} AND EXTRACT(MONTH FROM 마감월) = {int(month)})")
-    
-    clauses = [f"({' OR '.join(ym_conditions)})"]
+    # 연월 필터링을 위한 SQL 조건 생성 - 값은 모두 파라미터(?)로 바인딩
+    # 목록 필터는 IN (SELECT unnest(?)) 형태로 작성하여 DuckDB가 해시 세미조인으로 처리하도록 함
+    # 전체 옵션이 선택된 경우 값 목록 비교 대신 동일한 의미의 단순 조건 사용
+    where_params = []
+    if len(sel_yearmonths) == len(yearmonths_all):
+        clauses = ["마감월 IS NOT NULL"]
+    else:
+        # 선택 연월은 항상 연속 구간이므로 월별 OR 조건 대신 마감월 범위 조건 하나로 처리 (min/max 프루닝 가능)
+        clauses = ["마감월 >= ? AND 마감월 < ?"]
+        where_params.extend(month_range_params(sel_yearmonths))
     if plants_all:
-        clauses.append(f"플랜트 IN ({sql_list_num(sel_plants)})")
+        if set(sel_plants) == set(plants_all):
+            clauses.append("플랜트 > 0")
+        else:
+            clauses.append("플랜트 IN (SELECT unnest(?))")
+            where_params.append([int(p) for p in sel_plants])
     if groups_all:
-        clauses.append(f"구매그룹 IN ({sql_list_num(sel_groups)})")
-    if suppliers_all:
-        # 안전한 업체 필터 조건 생성
-        if "공급업체코드" in df.columns:
-            codes = []
-            for s in sel_suppliers:
-                if "_" in s:
-                    code = s.split("_", 1)[0]
-                    if code and code != "0":  # 유효한 코드만 추가
-                        codes.append(code)
-                elif s and s != "0":
-                    codes.append(s)
-            if codes:
-                clauses.append(f"공급업체코드 IN ({sql_list_str(codes)})")
+        if set(sel_groups) == set(groups_all):
+            clauses.append("구매그룹 > 0")
         else:
-            names = []
-            for s in sel_suppliers:
-                if "_" in s:
-                    name = s.split("_", 1)[1]
-                    if name and name.strip():
-                        names.append(name.strip())
-                elif s and s.strip():
-                    names.append(s.strip())
-            if names:
-                clauses.append(f"공급업체명 IN ({sql_list_str(names)})")
+            clauses.append("구매그룹 IN (SELECT unnest(?))")
+            where_params.append([int(g) for g in sel_groups])
+    supplier_col = "공급업체코드" if "공급업체코드" in df.columns else "공급업체명"
+    if suppliers_all:
+        # 안전한 업체 필터 조건 생성 (전체 선택은 고정 크기 세미조인, 일부 선택만 목록 바인딩)
+        supplier_condition = supplier_clause(sel_suppliers, suppliers_all, supplier_col, where_params)
+        if supplier_condition:
+            clauses.append(supplier_condition)
     
     # 자재 검색 조건 추가 (하단 검색과 전역 연동) - 다중 필터 지원
     material_search_conditions = []
@@ -448,29 +1142,19 @@ if df is not None and not df.empty:
     
     # 자재명 다중 검색 처리 (OR 조건)
     if material_name_search and material_name_search.strip():
-        name_patterns = []
         # 쉼표, 개행, 세미콜론으로 분리하여 다중 검색어 처리
         name_terms = [term.strip() for term in material_name_search.replace('\n', ',').replace(';', ',').split(',') if term.strip()]
-        for term in name_terms:
-            enhanced_name_patt = enhance_pattern(term)
-            name_patterns.append(f"자재명 ILIKE '{enhanced_name_patt}'")
-        
-        if name_patterns:
-            name_clause = " OR ".join(name_patterns)
+        if name_terms:
+            name_clause = material_name_clause(search_terms_condition("자재명_검색", name_terms, where_params))
             material_search_conditions.append(f"({name_clause})")
     
     # 자재코드 다중 검색 처리 (OR 조건, 엑셀 복사 지원)
     if material_code_search and material_code_search.strip():
-        code_patterns = []
         # 쉼표, 개행, 탭, 세미콜론으로 분리하여 다중 검색어 처리 (엑셀 복사 대응)
         code_terms = [term.strip() for term in material_code_search.replace('\n', ',').replace('\t', ',').replace(';', ',').split(',') if term.strip()]
-        for term in code_terms:
+        if code_terms:
             # 자재명과 동일한 로직: 모든 경우에 enhance_pattern 적용 (와일드카드 자동 추가)
-            enhanced_code_patt = enhance_pattern(term)
-            code_patterns.append(f"CAST(자재 AS VARCHAR) ILIKE '{enhanced_code_patt}'")
-        
-        if code_patterns:
-            code_clause = " OR ".join(code_patterns)
+            code_clause = search_terms_condition("자재코드_검색", code_terms, where_params)
             material_search_conditions.append(f"({code_clause})")
     
     if material_search_conditions:
@@ -479,6 +1163,8 @@ if df is not None and not df.empty:
         clauses.append(f"({material_clause})")
 
     where_sql = " WHERE " + " AND ".join(clauses)
+    # 자재 조건이 없으면 집계 쿼리는 월별 큐브에서 처리 (자재 단위 컬럼은 큐브에 없음)
+    agg_table = "data" if material_search_conditions else "monthly_cube"
 
     st.title("구매 데이터 추이 분석")
     
@@ -578,7 +1264,7 @@ if df is not None and not df.empty:
 
     # 시간 집계 단위에 따른 설정
     if time_unit == "월별":
-        time_col = "date_trunc('month', 마감월)"
+        time_col = "연월"
         time_name = "연월"
         time_format = "%Y년%m월"
     else:  # 연도별
@@ -587,52 +1273,57 @@ if df is not None and not df.empty:
         time_format = "%Y년"
 
     if group_option == "전체":
-        group_by_sql = ""
+        group_cols = []
         group_col = ""
-        if is_combined:
-            select_cols = f"{time_col} AS {time_name}, SUM(송장금액)/1000000 AS 송장금액_백만원, SUM(송장수량)/1000 AS 송장수량_천EA"
-        else:
-            select_cols = f"{time_col} AS {time_name}, {metric_col} AS {metric_name}"
-        # 시간별로만 그룹화하여 각 월당 1개 행만 생성
-        group_by_clause = f"GROUP BY {time_col}"
     elif group_option == "플랜트별":
-        group_by_sql = "플랜트,"
+        group_cols = ["플랜트"]
         group_col = "플랜트"
-        if is_combined:
-            select_cols = f"{time_col} AS {time_name}, {group_by_sql} SUM(송장금액)/1000000 AS 송장금액_백만원, SUM(송장수량)/1000 AS 송장수량_천EA"
-        else:
-            select_cols = f"{time_col} AS {time_name}, {group_by_sql} {metric_col} AS {metric_name}"
-        # 시간과 플랜트별로만 그룹화
-        group_by_clause = f"GROUP BY {time_col}, 플랜트"
     elif group_option == "업체별":
-        group_by_sql = "공급업체명,"
+        group_cols = ["공급업체명"]
         group_col = "공급업체명"
-        if is_combined:
-            select_cols = f"{time_col} AS {time_name}, {group_by_sql} SUM(송장금액)/1000000 AS 송장금액_백만원, SUM(송장수량)/1000 AS 송장수량_천EA"
-        else:
-            select_cols = f"{time_col} AS {time_name}, {group_by_sql} {metric_col} AS {metric_name}"
-        # 시간과 업체별로만 그룹화
-        group_by_clause = f"GROUP BY {time_col}, 공급업체명"
     elif group_option == "플랜트+업체별":
-        group_by_sql = "플랜트, 공급업체명,"
+        group_cols = ["플랜트", "공급업체명"]
         group_col = "플랜트_업체"
-        if is_combined:
-            select_cols = f"{time_col} AS {time_name}, {group_by_sql} SUM(송장금액)/1000000 AS 송장금액_백만원, SUM(송장수량)/1000 AS 송장수량_천EA"
-        else:
-            select_cols = f"{time_col} AS {time_name}, {group_by_sql} {metric_col} AS {metric_name}"
-        # 시간, 플랜트, 업체별로 그룹화
-        group_by_clause = f"GROUP BY {time_col}, 플랜트, 공급업체명"
+    time_keys = [time_name] + group_cols
+    metric_cols = ["송장금액_백만원", "송장수량_천EA"] if is_combined else [metric_name]
+
+    # 업체별 구매 현황도 같은 WHERE 조건을 쓰므로 GROUPING SETS로 한 번의 스캔에서 함께 집계
+    supplier_keys = {}
+    if suppliers_all:
+        if "공급업체코드" in df.columns:
+            supplier_keys["공급업체코드"] = "CASE WHEN 공급업체코드 = '' OR 공급업체코드 IS NULL THEN NULL ELSE 공급업체코드 END"
+        supplier_keys["공급업체명"] = "공급업체명"
+
+    select_exprs = [f"{time_col} AS {time_name}"] + group_cols
+    select_exprs += [f"{expr} AS {name}" for name, expr in supplier_keys.items() if name not in group_cols]
+    select_exprs += ["SUM(송장금액)/1000000 AS 송장금액_백만원", "SUM(송장수량)/1000 AS 송장수량_천EA"]
+    time_group = ", ".join([time_col] + group_cols)
+    if supplier_keys:
+        select_exprs.append(f"GROUPING({time_col}) AS 업체집계")
+        group_by_clause = f"GROUP BY GROUPING SETS (({time_group}), ({', '.join(supplier_keys.values())}))"
+    else:
+        group_by_clause = f"GROUP BY {time_group}"
 
     # SQL 쿼리 실행 및 디버깅 정보 수집
     sql_query = f"""
-        SELECT {select_cols}
-        FROM data
+        SELECT {', '.join(select_exprs)}
+        FROM {agg_table}
         {where_sql}
         {group_by_clause}
-        ORDER BY 1, 2{', 3' if group_option == '플랜트+업체별' else ''}
+        ORDER BY {', '.join(str(i) for i in range(1, len(time_keys) + 1))}
         """
     
-    time_df = con.execute(sql_query).fetchdf()
+    agg_df = cached_query(upload_key, sql_query, where_params, con)
+    if supplier_keys:
+        is_supplier_row = agg_df.pop("업체집계") == 1
+        sup_df = (
+            agg_df.loc[is_supplier_row, list(supplier_keys) + ["송장수량_천EA", "송장금액_백만원"]]
+            .sort_values(["송장금액_백만원", "송장수량_천EA"], ascending=False, ignore_index=True)
+        )
+        agg_df = agg_df.loc[~is_supplier_row]
+        # 업체 집계 행의 NULL 때문에 float로 바뀐 정수 키 컬럼을 원래 타입으로 복원
+        agg_df = agg_df.astype({c: "int64" for c in ("연도", "플랜트") if c in time_keys})
+    time_df = agg_df[time_keys + metric_cols].reset_index(drop=True)
     
 
     if time_df.empty:
@@ -658,25 +1349,10 @@ if df is not None and not df.empty:
         else:  # 연도별
             time_df["시간표시"] = time_df[time_name].astype(int).astype(str) + "년"
         
-        # 데이터 정렬 및 중복 방지 - 시간 순서로 정렬하여 차트에서 올바른 순서 보장
-        sort_columns = [time_name]
-        if group_option != "전체" and group_col in time_df.columns:
-            sort_columns.append(group_col)
-        
-        time_df = time_df.sort_values(sort_columns)
-        
-        # 추가 안전장치: 완전히 동일한 행이 있다면 제거 (GROUP BY가 제대로 작동하지 않은 경우 대비)
-        if group_option == "전체":
-            # 전체 분석의 경우 같은 시간에 대해서는 1개 행만 있어야 함
-            time_df = time_df.drop_duplicates(subset=[time_name], keep='first')
-        else:
-            # 그룹별 분석의 경우 (시간 + 그룹)에 대해 1개 행만 있어야 함
-            if group_col in time_df.columns:
-                dedup_columns = [time_name, group_col]
-                time_df = time_df.drop_duplicates(subset=dedup_columns, keep='first')
+        # 정렬과 중복 제거는 SQL의 GROUP BY / ORDER BY(시간 + 그룹 키)에서 이미 보장되므로 pandas에서 다시 하지 않음
         
         if group_option == "플랜트+업체별":
-            time_df["플랜트_업체"] = time_df["플랜트"].astype(str) + "_" + time_df["공급업체명"]
+            time_df["플랜트_업체"] = time_df["플랜트"].astype(str) + "_" + time_df["공급업체명"].astype(str)
         
         # 데이터 테이블 표시
         if is_combined:
@@ -743,411 +1419,16 @@ if df is not None and not df.empty:
                 }
             )
 
-        # 차트 생성 - 클릭 이벤트 추가
-        click = alt.selection_point(name="point_select")
-        
-        # X축 설정 개선 - 중복 방지 및 정렬
-        if time_unit == "월별":
-            # 월별 차트의 경우 시간을 정확히 처리하고 중복 방지
-            unique_months = sorted(time_df[time_name].unique())
-            
-            x_encoding = alt.X(
-                f"{time_name}:T", 
-                title=time_unit, 
-                axis=alt.Axis(
-                    format=time_format, 
-                    labelAngle=-45,
-                    labelOverlap=False,
-                    labelSeparation=15,
-                    values=unique_months,  # 정확한 월 값들만 표시
-                    offset=10  # X축을 아래로 이동하여 Y축과 거리 확보
-                ),
-                sort="ascending",
-                scale=alt.Scale(
-                    type="time",
-                    nice=False,
-                    domain=unique_months,  # 도메인을 정확한 월들로 제한
-                    padding=0.2,  # X축 양쪽 여백을 20%로 증가
-                    range=[50, {"expr": "width-50"}]  # 실제 차트 영역을 왼쪽 50px, 오른쪽 50px 안쪽으로 제한
-                )
-            )
-        else:
-            # 연도별의 경우
-            unique_years = sorted(time_df[time_name].unique())
-            x_encoding = alt.X(
-                f"{time_name}:O", 
-                title=time_unit,
-                axis=alt.Axis(offset=10),  # X축을 아래로 이동
-                sort="ascending",
-                scale=alt.Scale(
-                    domain=unique_years,  # 도메인 명시적 지정
-                    padding=0.2,  # X축 양쪽 여백을 20%로 증가
-                    range=[50, {"expr": "width-50"}]  # 실제 차트 영역을 왼쪽 50px, 오른쪽 50px 안쪽으로 제한
-                )
-            )
-
-        # 복합 차트 생성 함수 (이중축) - 누적막대 + 심미적 개선
-        def create_combined_chart(data, group_col_name=None):
-            # 데이터 포인트 수에 따른 동적 막대 두께 계산
-            data_points = len(data[time_name].unique()) if not data.empty else 1
-            # 2개월이면 두껍게, 12개월이면 적당하게
-            bar_size = max(15, min(60, 120 - data_points * 5))
-            
-            # 차트 속성 정의 - padding은 LayerChart에서 적용
-            chart_props = {
-                "height": 600,  # 고정 높이
-                "width": max(400, data_points * 80)  # 최소 400px, 데이터 포인트당 80px
-            }
-            
-            # 툴팁 설정
-            tooltip_cols = ["시간표시:N", "송장금액_백만원:Q", "송장수량_천EA:Q"]
-            if group_col_name:
-                tooltip_cols.insert(1, f"{group_col_name}:N")
-            
-            # **누적 막대를 위한 축 범위 계산 개선**
-            if group_col_name:
-                # 그룹별 데이터인 경우 시간별 누적값 계산
-                stacked_amounts = data.groupby(time_name)['송장금액_백만원'].sum()
-                max_stacked_amount = stacked_amounts.max() if not stacked_amounts.empty else 100
-            else:
-                # 전체 데이터인 경우
-                max_stacked_amount = data['송장금액_백만원'].max() if not data.empty else 100
-            
-            # 송장수량 범위 계산 (꺾은선을 누적막대 상단에 배치) - 개선된 축 설정
-            non_zero_quantities = data[data['송장수량_천EA'] > 0]['송장수량_천EA']
-            if not non_zero_quantities.empty:
-                max_quantity = non_zero_quantities.max()
-                # 최댓값을 10단위로 반올림 (깔끔한 축 표시)
-                import math
-                max_quantity_rounded = math.ceil(max_quantity / 10) * 10
-                
-                # 누적막대 최대값의 120% 지점을 꺾은선 시작점으로 설정
-                line_start_point = max_stacked_amount * 1.2
-                # 송장수량의 전체 범위를 상단 영역에 배치
-                line_height = max_stacked_amount * 0.6  # 누적막대 높이의 60%를 꺾은선 영역으로
-                min_quantity = 0  # 최솟값을 0으로 고정
-                
-                # 0부터 반올림된 최댓값까지의 범위를 line_height에 매핑
-                expanded_max_quantity = line_start_point + line_height
-                
-                # 데이터 변환을 위한 스케일링 팩터 계산 (0~max_quantity_rounded를 line_start_point~expanded_max_quantity로 변환)
-                if max_quantity_rounded > 0:
-                    quantity_scale_factor = line_height / max_quantity_rounded
-                    quantity_offset = line_start_point
-                else:
-                    quantity_scale_factor = 1
-                    quantity_offset = line_start_point
-            else:
-                max_quantity_rounded = 50
-                line_start_point = max_stacked_amount * 1.2
-                min_quantity = 0  # 최솟값을 0으로 고정
-                line_height = max_stacked_amount * 0.6
-                expanded_max_quantity = line_start_point + line_height
-                quantity_scale_factor = line_height / max_quantity_rounded
-                quantity_offset = line_start_point
-                
-            # 송장금액 범위는 누적값 기준으로 설정
-            expanded_max_amount = max_stacked_amount * 1.5  # 20% 여유공간
-            
-            # 송장수량 데이터를 상단 영역으로 변환
-            data = data.copy()
-            data['송장수량_변환'] = data['송장수량_천EA'] * quantity_scale_factor + quantity_offset
-            
-            # **누적 막대차트** - 왼쪽 축만 표시
-            if group_col_name:
-                # 그룹별 누적 막대차트
-                left_chart = alt.Chart(data).mark_bar(opacity=0.8, size=bar_size).encode(
-                    x=x_encoding,
-                    y=alt.Y('송장금액_백만원:Q', 
-                           title='송장금액(백만원)', 
-                           axis=alt.Axis(
-                               orient='left', 
-                               titleColor='steelblue', 
-                               grid=True,
-                               labelColor='steelblue',
-                               tickColor='steelblue',
-                               labelPadding=15,
-                               titlePadding=20,
-                               offset=5
-                           ),
-                           scale=alt.Scale(domain=[0, expanded_max_amount]),
-                           stack='zero'),  # **누적 설정**
-                    color=alt.Color(f"{group_col_name}:N", 
-                                   legend=alt.Legend(title=group_col_name, orient='right')),
-                    tooltip=tooltip_cols,
-                    order=alt.Order(f"{group_col_name}:N", sort='ascending')  # 누적 순서 일관성
-                ).properties(**chart_props)
-            else:
-                # 전체 데이터 막대차트 (누적 없음)
-                left_chart = alt.Chart(data).mark_bar(opacity=0.7, size=bar_size).encode(
-                    x=x_encoding,
-                    y=alt.Y('송장금액_백만원:Q', 
-                           title='송장금액(백만원)', 
-                           axis=alt.Axis(
-                               orient='left', 
-                               titleColor='steelblue', 
-                               grid=True,
-                               labelColor='steelblue',
-                               tickColor='steelblue',
-                               labelPadding=15,
-                               titlePadding=20,
-                               offset=5
-                           ),
-                           scale=alt.Scale(domain=[0, expanded_max_amount])),
-                    color=alt.value('steelblue'),
-                    tooltip=tooltip_cols
-                ).properties(**chart_props)
-            
-            # **꺾은선 차트** - 오른쪽 축만 표시, 확장된 Y축 범위
-            if group_col_name:
-                # 그룹별 꺾은선차트
-                right_chart = alt.Chart(data).mark_line(
-                    point=alt.OverlayMarkDef(size=100, filled=True), 
-                    strokeWidth=4
-                ).encode(
-                    x=x_encoding,
-                    y=alt.Y('송장수량_변환:Q', 
-                           title='송장수량(천EA)', 
-                           axis=alt.Axis(
-                               orient='right', 
-                               titleColor='red', 
-                               grid=False,
-                               labelColor='red',
-                               tickColor='red',
-                               labelPadding=15,
-                               titlePadding=20,
-                               offset=5,
-                               labelExpr=f'max(0, round((datum.value - {quantity_offset}) / {quantity_scale_factor}))'
-                           ),
-                           # **상단 영역으로 변환된 데이터 범위**
-                           scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
-                    color=alt.Color(f"{group_col_name}:N"),
-                    tooltip=tooltip_cols
-                ).properties(**chart_props)
-            else:
-                # 전체 데이터 꺾은선차트
-                right_chart = alt.Chart(data).mark_line(
-                    point=alt.OverlayMarkDef(size=100, filled=True), 
-                    strokeWidth=4
-                ).encode(
-                    x=x_encoding,
-                    y=alt.Y('송장수량_변환:Q', 
-                           title='송장수량(천EA)', 
-                           axis=alt.Axis(
-                               orient='right', 
-                               titleColor='red', 
-                               grid=False,
-                               labelColor='red',
-                               tickColor='red',
-                               labelPadding=15,
-                               titlePadding=20,
-                               offset=5,
-                               labelExpr=f'max(0, round((datum.value - {quantity_offset}) / {quantity_scale_factor}))'
-                           ),
-                           # **상단 영역으로 변환된 데이터 범위**
-                           scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
-                    color=alt.value('red'),
-                    tooltip=tooltip_cols
-                ).properties(**chart_props)
-            
-            # **데이터 레이블 개선**
-            if group_col_name:
-                # 누적 막대의 각 세그먼트에 레이블 표시 - 정확한 중점 계산
-                # 먼저 누적 데이터의 중점을 계산하기 위해 데이터를 변환
-                segment_data = data.copy()
-                segment_data = segment_data.sort_values([time_name, group_col_name])
-                
-                # 각 시점별로 누적 값 계산
-                cumulative_data = []
-                for time_val in segment_data[time_name].unique():
-                    time_group = segment_data[segment_data[time_name] == time_val]
-                    cumsum = 0
-                    for _, row in time_group.iterrows():
-                        start_y = cumsum
-                        end_y = cumsum + row['송장금액_백만원']
-                        mid_y = (start_y + end_y) / 2  # 중점 계산
-                        
-                        cumulative_data.append({
-                            time_name: time_val,
-                            group_col_name: row[group_col_name],
-                            '송장금액_백만원': row['송장금액_백만원'],
-                            'mid_y': mid_y  # 중점 위치
-                        })
-                        cumsum = end_y
-                
-                # 중점 데이터를 DataFrame으로 변환
-                mid_point_df = pd.DataFrame(cumulative_data)
-                
-                segment_text = alt.Chart(mid_point_df).mark_text(
-                    dy=0, fontSize=9, fontWeight='bold', color='white'
-                ).encode(
-                    x=x_encoding,
-                    y=alt.Y('mid_y:Q', 
-                           axis=None,
-                           scale=alt.Scale(domain=[0, expanded_max_amount])),
-                    text=alt.condition(
-                        alt.datum.송장금액_백만원 >= 20,  # 20 이상인 경우만 표시 (가독성 개선)
-                        alt.Text('송장금액_백만원:Q', format='.0f'),
-                        alt.value('')
-                    ),
-                    order=alt.Order(f"{group_col_name}:N", sort='ascending')
-                ).properties(**chart_props)
-                
-                # 전체 누적값도 상단에 표시
-                stacked_totals = data.groupby(time_name)['송장금액_백만원'].sum().reset_index()
-                stacked_totals[time_name] = pd.to_datetime(stacked_totals[time_name]) if time_unit == "월별" else stacked_totals[time_name]
-                
-                bar_text = alt.Chart(stacked_totals).mark_text(
-                    dy=-8, fontSize=10, fontWeight='bold', color='steelblue'
-                ).encode(
-                    x=x_encoding.copy(),
-                    y=alt.Y('송장금액_백만원:Q', 
-                           axis=None,
-                           scale=alt.Scale(domain=[0, expanded_max_amount])),
-                    text=alt.condition(
-                        alt.datum.송장금액_백만원 > 0,
-                        alt.Text('송장금액_백만원:Q', format='.0f'),
-                        alt.value('')
-                    )
-                ).properties(**chart_props)
-            else:
-                # 전체 데이터 막대 레이블
-                bar_text = alt.Chart(data).mark_text(dy=-8, fontSize=10, fontWeight='bold').encode(
-                    x=x_encoding,
-                    y=alt.Y('송장금액_백만원:Q', 
-                           axis=None,
-                           scale=alt.Scale(domain=[0, expanded_max_amount])),
-                    text=alt.condition(
-                        alt.datum.송장금액_백만원 > 0,
-                        alt.Text('송장금액_백만원:Q', format='.0f'),
-                        alt.value('')
-                    ),
-                    color=alt.value('black')
-                ).properties(**chart_props)
-            
-            # 꺾은선 차트 데이터 레이블 - 개선된 위치
-            if group_col_name:
-                line_text = alt.Chart(data).mark_text(
-                    dy=-15, fontSize=9, fontWeight='bold'
-                ).encode(
-                    x=x_encoding,
-                    y=alt.Y('송장수량_변환:Q', 
-                           axis=None,
-                           scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
-                    text=alt.condition(
-                        alt.datum.송장수량_천EA > 0,
-                        alt.Text('송장수량_천EA:Q', format='.0f'),
-                        alt.value('')
-                    ),
-                    color=alt.Color(f"{group_col_name}:N")
-                ).properties(**chart_props)
-            else:
-                line_text = alt.Chart(data).mark_text(
-                    dy=-15, fontSize=9, fontWeight='bold'
-                ).encode(
-                    x=x_encoding,
-                    y=alt.Y('송장수량_변환:Q', 
-                           axis=None,
-                           scale=alt.Scale(domain=[min_quantity, expanded_max_quantity])),
-                    text=alt.condition(
-                        alt.datum.송장수량_천EA > 0,
-                        alt.Text('송장수량_천EA:Q', format='.0f'),
-                        alt.value('')
-                    ),
-                    color=alt.value('red')
-                ).properties(**chart_props)
-            
-            # **완전한 이중축 차트 - 각 축이 독립적으로 표시**
-            if group_col_name:
-                combined_chart = alt.layer(
-                    left_chart,    # 누적 막대차트 (왼쪽 축)
-                    right_chart,   # 꺾은선차트 (오른쪽 축, 확장된 범위)
-                    segment_text,  # 누적 막대 세그먼트 레이블
-                    bar_text,      # 막대차트 총합 레이블
-                    line_text      # 꺾은선차트 레이블
-                ).resolve_scale(y='independent').properties(
-                    title=f"구매 데이터 추이 - {unit_text}",
-                    padding={"left": 100, "top": 40, "right": 100, "bottom": 50}
-                )
-            else:
-                combined_chart = alt.layer(
-                    left_chart,   # 일반 막대차트 (왼쪽 축)
-                    right_chart,  # 꺾은선차트 (오른쪽 축, 확장된 범위)
-                    bar_text,     # 막대차트 레이블
-                    line_text     # 꺾은선차트 레이블
-                ).resolve_scale(y='independent').properties(
-                    title=f"구매 데이터 추이 - {unit_text}",
-                    padding={"left": 100, "top": 40, "right": 100, "bottom": 50}
-                )
-            
-            return combined_chart.add_params(click)
-
-        if is_combined:
-            # 복합 차트 처리
-            if group_option == "전체":
-                chart = create_combined_chart(time_df)
-            elif group_option in ["플랜트+업체별", "파트+카테고리(최종)별", "파트+KPI용카테고리별"]:
-                chart = create_combined_chart(time_df, group_col)
-            else:
-                chart = create_combined_chart(time_df, group_col)
-        elif group_option == "전체":
-            base = alt.Chart(time_df)
-            line = base.mark_line(point=alt.OverlayMarkDef(size=100)).encode(
-                x=x_encoding,
-                y=alt.Y(f"{metric_name}:Q", title=y_title),
-                tooltip=["시간표시:N", f"{metric_name}:Q"]
-            )
-            text = base.mark_text(dy=-15, fontSize=11, fontWeight='bold', color='darkblue').encode(
-                x=x_encoding,
-                y=alt.Y(f"{metric_name}:Q"),
-                text=alt.condition(
-                    f"datum.{metric_name} > 0",
-                    alt.Text(f"{metric_name}:Q", format='.0f'),
-                    alt.value('')
-                )
-            )
-            chart = (line + text).add_params(click)
-        elif group_option == "플랜트+업체별":
-            base = alt.Chart(time_df)
-            line = base.mark_line(point=True).encode(
-                x=x_encoding,
-                y=alt.Y(f"{metric_name}:Q", title=y_title),
-                color=alt.Color("플랜트_업체:N", title="플랜트_업체"),
-                tooltip=["시간표시:N", "플랜트:O", "공급업체명:N", f"{metric_name}:Q"]
-            )
-            text = base.mark_text(dy=-15, fontSize=9, fontWeight='bold').encode(
-                x=x_encoding,
-                y=alt.Y(f"{metric_name}:Q"),
-                text=alt.condition(
-                    f"datum.{metric_name} > 0",
-                    alt.Text(f"{metric_name}:Q", format='.0f'),
-                    alt.value('')
-                ),
-                color=alt.Color("플랜트_업체:N")
-            )
-            chart = (line + text).add_params(click)
-        else:
-            base = alt.Chart(time_df)
-            line = base.mark_line(point=True).encode(
-                x=x_encoding,
-                y=alt.Y(f"{metric_name}:Q", title=y_title),
-                color=alt.Color(f"{group_col}:N", title=group_col),
-                tooltip=["시간표시:N", f"{group_col}:N", f"{metric_name}:Q"]
-            )
-            text = base.mark_text(dy=-15, fontSize=9, fontWeight='bold').encode(
-                x=x_encoding,
-                y=alt.Y(f"{metric_name}:Q"),
-                text=alt.condition(
-                    f"datum.{metric_name} > 0",
-                    alt.Text(f"{metric_name}:Q", format='.0f'),
-                    alt.value('')
-                ),
-                color=alt.Color(f"{group_col}:N")
-            )
-            chart = (line + text).add_params(click)
-        
         # 차트 표시 및 클릭 이벤트 처리
-        event = st.altair_chart(chart, use_container_width=True, key="main_chart")
+        try:
+            chart_spec = build_trend_chart_spec(
+                time_df, time_unit, time_name, time_format, group_option, group_col,
+                is_combined, metric_name, y_title, unit_text,
+            )
+            event = st.vega_lite_chart(chart_spec, use_container_width=True, key="main_chart")
+        except alt.MaxRowsError:
+            st.warning(f"차트 데이터가 {TREND_CHART_MAX_ROWS:,}행을 넘어 차트를 표시하지 않습니다. 기간이나 필터 조건을 좁혀 주세요.")
+            event = None
         
         
         # 클릭 이벤트 처리 (안전한 방식)
@@ -1219,21 +1500,18 @@ if df is not None and not df.empty:
             with col2:
                 # 그룹 선택 (필요한 경우)
                 if group_option != "전체":
-                    # 선택된 기간의 모든 데이터에서 그룹 옵션 가져오기
-                    period_filter_conditions = []
-                    for ym in query_yearmonths:
-                        year, month = ym.split('-')
-                        period_filter_conditions.append(f"(EXTRACT(YEAR FROM 마감월) = {year} AND EXTRACT(MONTH FROM 마감월) = {int(month)})")
-                    
-                    period_where = " OR ".join(period_filter_conditions)
+                    # 선택된 기간의 모든 데이터에서 그룹 옵션 가져오기 (조회 기간은 연속 구간이므로 범위 조건 하나로 처리)
+                    period_where = "마감월 >= ? AND 마감월 < ?"
+                    period_params = month_range_params(query_yearmonths)
                     
+                    # 기간별 옵션 조회는 cached_query로 캐시하여 라디오/버튼 조작으로 인한 rerun 시 재조회하지 않음
                     if group_option == "플랜트별":
                         # 기간 내 플랜트 옵션 조회
-                        plants_in_period = con.execute(f"""
-                            SELECT DISTINCT 플랜트 FROM data 
+                        plants_in_period = cached_query(upload_key, f"""
+                            SELECT DISTINCT 플랜트 FROM monthly_cube 
                             WHERE ({period_where}) AND 플랜트 > 0
                             ORDER BY 플랜트
-                        """).fetchdf()['플랜트'].tolist()
+                        """, period_params, con)["플랜트"].tolist()
                         
                         if plants_in_period:
                             selected_group = st.selectbox("플랜트 선택", options=plants_in_period, key="plant_select_period")
@@ -1244,11 +1522,11 @@ if df is not None and not df.empty:
                             
                     elif group_option == "업체별":
                         # 기간 내 업체 옵션 조회
-                        suppliers_in_period = con.execute(f"""
-                            SELECT DISTINCT 공급업체명 FROM data 
+                        suppliers_in_period = cached_query(upload_key, f"""
+                            SELECT DISTINCT 공급업체명 FROM monthly_cube 
                             WHERE ({period_where}) AND 공급업체명 IS NOT NULL AND 공급업체명 != ''
                             ORDER BY 공급업체명
-                        """).fetchdf()['공급업체명'].tolist()
+                        """, period_params, con)["공급업체명"].tolist()
                         
                         if suppliers_in_period:
                             selected_group = st.selectbox("업체 선택", options=suppliers_in_period, key="supplier_select_period")
@@ -1259,22 +1537,21 @@ if df is not None and not df.empty:
                             
                     else:  # 플랜트+업체별
                         # 기간 내 플랜트+업체 조합 조회
-                        combos_in_period = con.execute(f"""
-                            SELECT DISTINCT 플랜트, 공급업체명 FROM data 
+                        combos_in_period = cached_query(upload_key, f"""
+                            SELECT DISTINCT 플랜트, 공급업체명 FROM monthly_cube 
                             WHERE ({period_where}) AND 플랜트 > 0 AND 공급업체명 IS NOT NULL AND 공급업체명 != ''
                             ORDER BY 플랜트, 공급업체명
-                        """).fetchdf()
+                        """, period_params, con)
                         
                         if not combos_in_period.empty:
-                            combo_options = []
-                            for _, row in combos_in_period.iterrows():
-                                plant = int(row['플랜트'])
-                                supplier = row['공급업체명']
-                                combo_options.append(f"플랜트{plant}-{supplier}")
+                            # 표시 문자열은 컬럼 단위로 한 번에 만들고, 선택값은 문자열 파싱 대신 미리 만든 매핑에서 조회
+                            plants = combos_in_period['플랜트'].astype(int)
+                            suppliers = combos_in_period['공급업체명'].astype(str)
+                            combo_labels = "플랜트" + plants.astype(str) + "-" + suppliers
+                            combo_map = dict(zip(combo_labels, zip(plants.tolist(), suppliers.tolist())))
                             
-                            selected_combo = st.selectbox("플랜트-업체 선택", options=combo_options, key="combo_select_period")
-                            plant_val = int(selected_combo.split('-')[0].replace('플랜트', ''))
-                            supplier_val = selected_combo.split('-', 1)[1]
+                            selected_combo = st.selectbox("플랜트-업체 선택", options=list(combo_map), key="combo_select_period")
+                            plant_val, supplier_val = combo_map[selected_combo]
                             info_text = f"플랜트: {plant_val}, 업체: {supplier_val}"
                         else:
                             st.warning("해당 기간에 플랜트+업체 데이터가 없습니다.")
@@ -1285,13 +1562,9 @@ if df is not None and not df.empty:
             
             # Raw 데이터 조회 버튼
             if st.button("상세 데이터 조회", type="primary", key="raw_data_query_btn"):
-                # 연월 기간 필터 조건 생성
-                period_conditions = []
-                for ym in query_yearmonths:
-                    year, month = ym.split('-')
-                    period_conditions.append(f"(EXTRACT(YEAR FROM 마감월) = {year} AND EXTRACT(MONTH FROM 마감월) = {int(month)})")
-                
-                period_filter = " OR ".join(period_conditions)
+                # 연월 기간 필터 조건 생성 - 월별 OR 조건 대신 마감월 범위 조건 하나로 처리
+                period_filter = "마감월 >= ? AND 마감월 < ?"
+                raw_params = month_range_params(query_yearmonths)
                 
                 # 기본 쿼리 - 정밀도 보존을 위해 문자열 그대로 사용
                 supplier_code_select = ""
@@ -1317,41 +1590,33 @@ if df is not None and not df.empty:
                 # 기존 필터 조건 추가
                 additional_filters = []
                 if plants_all and sel_plants:
-                    additional_filters.append(f"플랜트 IN ({sql_list_num(sel_plants)})")
+                    if set(sel_plants) == set(plants_all):
+                        additional_filters.append("플랜트 > 0")
+                    else:
+                        additional_filters.append("플랜트 IN (SELECT unnest(?))")
+                        raw_params.append([int(p) for p in sel_plants])
                 if groups_all and sel_groups:
-                    additional_filters.append(f"구매그룹 IN ({sql_list_num(sel_groups)})")
-                if suppliers_all and sel_suppliers:
-                    # 안전한 업체 필터 조건 생성
-                    if "공급업체코드" in df.columns:
-                        codes = []
-                        for s in sel_suppliers:
-                            if "_" in s:
-                                code = s.split("_", 1)[0]
-                                if code and code != "0":  # 유효한 코드만 추가
-                                    codes.append(code)
-                            elif s and s != "0":
-                                codes.append(s)
-                        if codes:
-                            additional_filters.append(f"공급업체코드 IN ({sql_list_str(codes)})")
+                    if set(sel_groups) == set(groups_all):
+                        additional_filters.append("구매그룹 > 0")
                     else:
-                        names = []
-                        for s in sel_suppliers:
-                            if "_" in s:
-                                name = s.split("_", 1)[1]
-                                if name and name.strip():
-                                    names.append(name.strip())
-                            elif s and s.strip():
-                                names.append(s.strip())
-                        if names:
-                            additional_filters.append(f"공급업체명 IN ({sql_list_str(names)})")
+                        additional_filters.append("구매그룹 IN (SELECT unnest(?))")
+                        raw_params.append([int(g) for g in sel_groups])
+                if suppliers_all and sel_suppliers:
+                    # 안전한 업체 필터 조건 생성 (전체 선택은 고정 크기 세미조인, 일부 선택만 목록 바인딩)
+                    supplier_condition = supplier_clause(sel_suppliers, suppliers_all, supplier_col, raw_params)
+                    if supplier_condition:
+                        additional_filters.append(supplier_condition)
                 
                 # 그룹별 추가 필터
                 if group_option == "플랜트별" and 'selected_group' in locals() and selected_group is not None:
-                    additional_filters.append(f"플랜트 = {selected_group}")
+                    additional_filters.append("플랜트 = ?")
+                    raw_params.append(int(selected_group))
                 elif group_option == "업체별" and 'selected_group' in locals() and selected_group is not None:
-                    additional_filters.append(f"공급업체명 = '{selected_group.replace("'", "''")}'")  # SQL 이스케이프
+                    additional_filters.append("공급업체명 = ?")
+                    raw_params.append(selected_group)
                 elif group_option == "플랜트+업체별" and 'plant_val' in locals() and 'supplier_val' in locals() and plant_val is not None and supplier_val is not None:
-                    additional_filters.append(f"플랜트 = {plant_val} AND 공급업체명 = '{supplier_val.replace("'", "''")}'")  # SQL 이스케이프
+                    additional_filters.append("플랜트 = ? AND 공급업체명 = ?")
+                    raw_params.extend([plant_val, supplier_val])
                 
                 if additional_filters:
                     raw_data_query += " AND " + " AND ".join(additional_filters)
@@ -1359,35 +1624,39 @@ if df is not None and not df.empty:
                 raw_data_query += " ORDER BY 마감월, 공급업체명, 자재코드"
                 
                 # 쿼리 실행
-                raw_df = con.execute(raw_data_query).fetchdf()
+                raw_df = con.execute(raw_data_query, raw_params).fetchdf()
                 
                 # 결과 표시
                 if not raw_df.empty:
+                    # 월별 누계와 전체 합계는 이미 조회한 raw_df의 월 단위 groupby 한 번으로 계산 (같은 조건으로 테이블을 다시 스캔하지 않음)
+                    month_groups = raw_df.groupby('마감월', sort=True)
+                    monthly_stats = pd.DataFrame({
+                        '송장금액': month_groups['송장금액'].sum(),
+                        '송장수량': month_groups['송장수량'].sum(),
+                        '자재건수': month_groups['자재코드'].count(),
+                        '단가합계': month_groups['단가'].sum(),
+                        '단가건수': month_groups['단가'].count(),
+                    })
+                    total_materials = len(raw_df)
+                    total_amount = monthly_stats['송장금액'].sum()
+                    total_quantity = monthly_stats['송장수량'].sum()
+                    price_count = monthly_stats['단가건수'].sum()
+                    avg_price = monthly_stats['단가합계'].sum() / price_count if price_count else None
+                    zero_amounts = int(raw_df['송장금액'].eq(0).sum())
+                    zero_quantities = int(raw_df['송장수량'].eq(0).sum())
+                    
                     period_text = f"{min(query_yearmonths)}~{max(query_yearmonths)}" if len(query_yearmonths) > 1 else query_yearmonths[0]
-                    st.success(f"**{period_text} 기간 총 {len(raw_df):,}건의 데이터를 찾았습니다!**")
+                    st.success(f"**{period_text} 기간 총 {total_materials:,}건의 데이터를 찾았습니다!**")
                     
                     # 데이터 품질 간단 체크
-                    zero_amounts = (raw_df['송장금액'] == 0).sum() if '송장금액' in raw_df.columns else 0
-                    zero_quantities = (raw_df['송장수량'] == 0).sum() if '송장수량' in raw_df.columns else 0
-                    
-                    if zero_amounts > len(raw_df) * 0.3:
+                    if zero_amounts > total_materials * 0.3:
                         st.warning(f"주의: 송장금액이 0인 데이터가 {zero_amounts}건 있습니다.")
-                    if zero_quantities > len(raw_df) * 0.3:
+                    if zero_quantities > total_materials * 0.3:
                         st.warning(f"주의: 송장수량이 0인 데이터가 {zero_quantities}건 있습니다.")
                     
-                    # 전체 데이터 요약 정보 표시
-                    total_amount = raw_df['송장금액'].sum()
-                    total_quantity = raw_df['송장수량'].sum()
-                    total_materials = len(raw_df)
-                    
                     if len(query_yearmonths) > 1:
                         # 특정 기간: 월별 누계 현황
-                        summary_df = raw_df.groupby('마감월').agg({
-                            '송장금액': 'sum',
-                            '송장수량': 'sum',
-                            '자재코드': 'count'
-                        }).reset_index()
-                        summary_df.columns = ['연월', '송장금액', '송장수량', '자재건수']
+                        summary_df = monthly_stats[['송장금액', '송장수량', '자재건수']].rename_axis('연월').reset_index()
                         
                         st.subheader("월별 누계 현황")
                         col1, col2, col3 = st.columns(3)
@@ -1426,16 +1695,30 @@ if df is not None and not df.empty:
                     
                     st.subheader("상세 Raw 데이터")
                     
-                    # 합계 행 추가
+                    raw_column_config = {
+                        "송장금액": st.column_config.NumberColumn(
+                            "송장금액",
+                            format="%.0f"
+                        ),
+                        "송장수량": st.column_config.NumberColumn(
+                            "송장수량", 
+                            format="%.0f"
+                        ),
+                        "단가": st.column_config.NumberColumn(
+                            "단가",
+                            format="%.0f"
+                        )
+                    }
+                    st.dataframe(
+                        raw_df, 
+                        use_container_width=True, 
+                        hide_index=True,
+                        column_config=raw_column_config
+                    )
+                    
+                    # 합계 행은 원본에 이어 붙이지 않고 (전체 행 복사 방지) 같은 형식의 별도 한 줄 표로 아래에 표시
                     if not raw_df.empty:
-                        # 숫자 컬럼들의 합계/평균 계산
-                        totals = {
-                            '송장수량': raw_df['송장수량'].sum(),
-                            '송장금액': raw_df['송장금액'].sum(),
-                            '단가': raw_df['단가'].mean()  # 단가는 평균으로 계산
-                        }
-                        
-                        # 합계 행 생성 - 모든 필수 컬럼 포함
+                        # 합계 행 생성 - 모든 필수 컬럼 포함 (합계/평균 단가는 위 월별 집계 결과 재사용)
                         total_row_data = {
                             '마감월': '합계',
                             '플랜트': None,
@@ -1443,43 +1726,21 @@ if df is not None and not df.empty:
                             '공급업체명': '전체 합계',
                             '자재코드': None,
                             '자재명': '총계',
-                            '송장수량': totals['송장수량'],
-                            '송장금액': totals['송장금액'],
-                            '단가': totals['단가']
+                            '송장수량': total_quantity,
+                            '송장금액': total_amount,
+                            '단가': avg_price  # 단가는 평균으로 계산
                         }
                         
                         # 공급업체코드 컬럼이 있는 경우 추가
                         if "공급업체코드" in raw_df.columns:
                             total_row_data['공급업체코드'] = None
                         
-                        # 새로운 컬럼들이 있는 경우 추가
-                        
-                        total_row = pd.DataFrame([total_row_data])
-                        
-                        # 원본 데이터와 합계 행 결합
-                        raw_df_with_totals = pd.concat([raw_df, total_row], ignore_index=True)
-                    else:
-                        raw_df_with_totals = raw_df
-                    
-                    st.dataframe(
-                        raw_df_with_totals, 
-                        use_container_width=True, 
-                        hide_index=True,
-                        column_config={
-                            "송장금액": st.column_config.NumberColumn(
-                                "송장금액",
-                                format="%.0f"
-                            ),
-                            "송장수량": st.column_config.NumberColumn(
-                                "송장수량", 
-                                format="%.0f"
-                            ),
-                            "단가": st.column_config.NumberColumn(
-                                "단가",
-                                format="%.0f"
-                            )
-                        }
-                    )
+                        st.dataframe(
+                            pd.DataFrame([total_row_data], columns=raw_df.columns), 
+                            use_container_width=True, 
+                            hide_index=True,
+                            column_config=raw_column_config
+                        )
                     
                     # CSV 다운로드
                     filename_suffix = period_text.replace('~', '_to_').replace('-', '')
@@ -1488,7 +1749,7 @@ if df is not None and not df.empty:
                     
                     st.download_button(
                         "상세 데이터 CSV 다운로드",
-                        raw_df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig"),
+                        to_csv_bytes(raw_df),
                         file_name=f"raw_data_{filename_suffix}.csv",
                         mime="text/csv",
                     )
@@ -1502,38 +1763,27 @@ if df is not None and not df.empty:
     st.caption(f"단위: {unit_text}")
 
     if suppliers_all:
-        # 안전한 업체별 구매 현황 쿼리
-        supplier_code_select = ""
-        group_by_clause = "1"
-        order_by_clause = "2"
-        
-        if "공급업체코드" in df.columns:
-            supplier_code_select = """
-                   CASE 
-                       WHEN 공급업체코드 = '' OR 공급업체코드 IS NULL THEN NULL
-                       ELSE 공급업체코드
-                   END AS 공급업체코드,
-            """
-            group_by_clause = "1, 2"
-            order_by_clause = "3"
-        
-        sup_df = con.execute(
-            f"""
-            SELECT{supplier_code_select}
-                   공급업체명,
-                   SUM(송장수량)/1000    AS 송장수량_천EA,
-                   SUM(송장금액)/1000000 AS 송장금액_백만원
-            FROM data
-            {where_sql}
-            GROUP BY {group_by_clause}
-            ORDER BY 송장금액_백만원 DESC, 송장수량_천EA DESC
-            """
-        ).fetchdf()
-
         st.markdown("---")
         st.header(" 업체별 구매 현황")
         
-        # 합계 행 추가
+        sup_column_config = {
+            "송장금액_백만원": st.column_config.NumberColumn(
+                "송장금액(백만원)",
+                format="%.0f"
+            ),
+            "송장수량_천EA": st.column_config.NumberColumn(
+                "송장수량(천EA)", 
+                format="%.0f"
+            )
+        }
+        st.dataframe(
+            sup_df, 
+            hide_index=True, 
+            use_container_width=True,
+            column_config=sup_column_config
+        )
+        
+        # 합계 행은 원본에 이어 붙이지 않고 (전체 행 복사 방지) 같은 형식의 별도 한 줄 표로 아래에 표시
         if not sup_df.empty:
             # 숫자 컬럼들의 합계 계산
             totals = {
@@ -1556,31 +1806,16 @@ if df is not None and not df.empty:
                     '송장금액_백만원': totals['송장금액_백만원']
                 }])
             
-            # 원본 데이터와 합계 행 결합
-            sup_df_with_totals = pd.concat([sup_df, total_row], ignore_index=True)
-        else:
-            sup_df_with_totals = sup_df
-        
-        st.dataframe(
-            sup_df_with_totals, 
-            hide_index=True, 
-            use_container_width=True,
-            column_config={
-                "송장금액_백만원": st.column_config.NumberColumn(
-                    "송장금액(백만원)",
-                    format="%.0f"
-                ),
-                "송장수량_천EA": st.column_config.NumberColumn(
-                    "송장수량(천EA)", 
-                    format="%.0f"
-                )
-            }
-        )
+            st.dataframe(
+                total_row, 
+                hide_index=True, 
+                use_container_width=True,
+                column_config=sup_column_config
+            )
 
-        if not sup_df.empty:
             st.download_button(
                 "업체별 CSV 다운로드",
-                sup_df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig"),
+                to_csv_bytes(sup_df),
                 file_name="supplier_summary.csv",
                 mime="text/csv",
             )
@@ -1589,43 +1824,49 @@ if df is not None and not df.empty:
     st.header("자재 검색 (다중 필터 지원)")
     
     # 전역 연동 안내
-    st.info("**여기서 입력한 검색 조건이 위의 모든 차트와 분석에 자동 적용됩니다!**")
+    st.info("**여기서 입력한 검색 조건은 검색 버튼을 누르면 위의 모든 차트와 분석에 적용됩니다!**")
     
     
-    col1, col2, col3 = st.columns([4, 4, 2])
-    with col1:
-        material_name_patt = st.text_area(
-            "자재명 다중 검색", 
-            placeholder="예시:\n*퍼퓸*, *로션*\n또는\n*퍼퓸*\n*로션*\n*크림*",
-            value=st.session_state.global_material_name_search,
-            key="material_name_input",
-            height=100
-        )
-    with col2:
-        material_code_patt = st.text_area(
-            "자재코드 다중 검색", 
-            placeholder="예시:\n1234567, 2345678\n또는 엑셀 복사 붙여넣기",
-            value=st.session_state.global_material_code_search,
-            key="material_code_input",
-            height=100
-        )
-    with col3:
-        st.write("")  # 여백
-        if st.button("🗑️ 자재 검색 초기화", key="clear_material_search"):
-            st.session_state.global_material_name_search = ""
-            st.session_state.global_material_code_search = ""
-            # widget key 삭제 (안전하게)
-            if 'material_name_input' in st.session_state:
-                del st.session_state['material_name_input']
-            if 'material_code_input' in st.session_state:
-                del st.session_state['material_code_input']
-            st.rerun()
+    # 입력 중에는 rerun/쿼리가 실행되지 않도록 폼으로 묶고, 검색 버튼 제출 시에만 반영
+    with st.form("material_search_form"):
+        col1, col2, col3 = st.columns([4, 4, 2])
+        with col1:
+            material_name_patt = st.text_area(
+                "자재명 다중 검색", 
+                placeholder="예시:\n*퍼퓸*, *로션*\n또는\n*퍼퓸*\n*로션*\n*크림*",
+                value=st.session_state.global_material_name_search,
+                key="material_name_input",
+                height=100
+            )
+        with col2:
+            material_code_patt = st.text_area(
+                "자재코드 다중 검색", 
+                placeholder="예시:\n1234567, 2345678\n또는 엑셀 복사 붙여넣기",
+                value=st.session_state.global_material_code_search,
+                key="material_code_input",
+                height=100
+            )
+        with col3:
+            st.write("")  # 여백
+            search_submitted = st.form_submit_button("🔍 검색", type="primary")
+            clear_submitted = st.form_submit_button("🗑️ 자재 검색 초기화")
 
-    # session_state 업데이트
-    if material_name_patt != st.session_state.global_material_name_search:
-        st.session_state.global_material_name_search = material_name_patt
+    if clear_submitted:
+        st.session_state.global_material_name_search = ""
+        st.session_state.global_material_code_search = ""
+        # widget key 삭제 (안전하게)
+        if 'material_name_input' in st.session_state:
+            del st.session_state['material_name_input']
+        if 'material_code_input' in st.session_state:
+            del st.session_state['material_code_input']
         st.rerun()
-    if material_code_patt != st.session_state.global_material_code_search:
+
+    # session_state 업데이트 - 자재명/자재코드 변경을 한 번에 반영하여 rerun 1회로 처리
+    if search_submitted and (
+        material_name_patt != st.session_state.global_material_name_search
+        or material_code_patt != st.session_state.global_material_code_search
+    ):
+        st.session_state.global_material_name_search = material_name_patt
         st.session_state.global_material_code_search = material_code_patt
         st.rerun()
     
@@ -1657,17 +1898,13 @@ if df is not None and not df.empty:
     search_conditions = []
     search_info = []
     search_where = ""  # 자재 검색 조건 (전월대비 분석 등에서도 사용)
+    search_params = []
 
     # 자재명 다중 검색 처리 (OR 조건)
     if material_name_patt:
-        name_patterns = []
         name_terms = [term.strip() for term in material_name_patt.replace('\n', ',').replace(';', ',').split(',') if term.strip()]
-        for term in name_terms:
-            enhanced_name_patt = enhance_pattern(term)
-            name_patterns.append(f"자재명 ILIKE '{enhanced_name_patt}'")
-
-        if name_patterns:
-            name_clause = " OR ".join(name_patterns)
+        if name_terms:
+            name_clause = material_name_clause(search_terms_condition("자재명_검색", name_terms, search_params))
             search_conditions.append(f"({name_clause})")
             if len(name_terms) > 1:
                 search_info.append(f"자재명: {len(name_terms)}개 조건")
@@ -1676,15 +1913,10 @@ if df is not None and not df.empty:
 
     # 자재코드 다중 검색 처리 (OR 조건, 엑셀 복사 지원)
     if material_code_patt:
-        code_patterns = []
         code_terms = [term.strip() for term in material_code_patt.replace('\n', ',').replace('\t', ',').replace(';', ',').split(',') if term.strip()]
-        for term in code_terms:
+        if code_terms:
             # 자재명과 동일한 로직: 모든 경우에 enhance_pattern 적용 (와일드카드 자동 추가)
-            enhanced_code_patt = enhance_pattern(term)
-            code_patterns.append(f"CAST(자재 AS VARCHAR) ILIKE '{enhanced_code_patt}'")
-
-        if code_patterns:
-            code_clause = " OR ".join(code_patterns)
+            code_clause = search_terms_condition("자재코드_검색", code_terms, search_params)
             search_conditions.append(f"({code_clause})")
             if len(code_terms) > 1:
                 search_info.append(f"자재코드: {len(code_terms)}개 조건")
@@ -1705,8 +1937,7 @@ if df is not None and not df.empty:
                    END AS 공급업체코드,
             """
         
-        search_df = con.execute(
-            f"""
+        search_sql = f"""
             SELECT strftime(마감월, '%Y-%m') AS 마감월, strftime(연월, '%Y-%m') AS 연월, 연도, 플랜트, 구매그룹,{search_supplier_code_select}
                    {"공급업체명, " if "공급업체명" in df.columns else ""}
                    자재 AS 자재코드,
@@ -1716,16 +1947,32 @@ if df is not None and not df.empty:
                    송장금액/1000000 AS 송장금액_백만원
             FROM data
             {where_sql} AND ({search_where})
-            ORDER BY 마감월, 공급업체명, 자재코드
+            ORDER BY 마감월, 공급업체명, 자재코드, 플랜트, 구매그룹, 단가
             """
+
+        # 전체 건수와 월별 요약은 집계 쿼리로 계산하고, 상세는 페이지 단위로만 조회
+        search_summary = con.execute(
+            f"""
+            SELECT strftime(연월, '%Y-%m') AS 연월,
+                   SUM(송장금액/1000000) AS 송장금액_백만원,
+                   SUM(송장수량/1000)    AS 송장수량_천EA,
+                   COUNT(자재)           AS 자재건수,
+                   COUNT(*)              AS 행수
+            FROM data
+            {where_sql} AND ({search_where})
+            GROUP BY 1
+            ORDER BY 1
+            """,
+            where_params + search_params
         ).fetchdf()
+        search_total = int(search_summary.pop("행수").sum())
 
         # 검색 조건 표시
         search_info_text = ", ".join(search_info)
         st.write(f"검색 조건: {search_info_text}")
-        st.write(f"검색 결과: **{len(search_df):,}건** 일치")
+        st.write(f"검색 결과: **{search_total:,}건** 일치")
         
-        if search_df.empty:
+        if search_total == 0:
             st.warning("검색 결과가 없습니다.")
             st.info("검색 팁:")
             st.write("1. 와일드카드 '*' 사용: *퍼퓸*1L*")
@@ -1734,14 +1981,7 @@ if df is not None and not df.empty:
             st.write("4. 현재 선택된 기간과 필터 조건을 확인해보세요")
         else:
             # 연월별 검색 결과 요약
-            if len(search_df) > 0 and len(sel_yearmonths) > 1:
-                search_summary = search_df.groupby('연월').agg({
-                    '송장금액_백만원': 'sum',
-                    '송장수량_천EA': 'sum',
-                    '자재코드': 'count'
-                }).reset_index()
-                search_summary.columns = ['연월', '송장금액_백만원', '송장수량_천EA', '자재건수']
-                
+            if len(sel_yearmonths) > 1:
                 st.subheader("검색결과 월별 요약")
                 st.dataframe(
                     search_summary, 
@@ -1760,6 +2000,18 @@ if df is not None and not df.empty:
                 )
             
             st.subheader("검색결과 상세")
+            page_count = (search_total - 1) // SEARCH_PAGE_SIZE + 1
+            page = 1
+            if page_count > 1:
+                page = st.number_input(
+                    f"페이지 (총 {page_count}페이지, 페이지당 {SEARCH_PAGE_SIZE}건)",
+                    min_value=1, max_value=page_count, value=1, step=1,
+                    key="search_page",
+                )
+            search_df = con.execute(
+                f"{search_sql} LIMIT ? OFFSET ?",
+                where_params + search_params + [SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE]
+            ).fetchdf()
             st.dataframe(
                 search_df, 
                 use_container_width=True,
@@ -1778,12 +2030,18 @@ if df is not None and not df.empty:
                     )
                 }
             )
-            st.download_button(
-                "검색결과 CSV 다운로드",
-                search_df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig"),
-                file_name="search_results.csv",
-                mime="text/csv",
-            )
+            # 전체 결과 조회는 비용이 크므로 버튼을 눌렀을 때만 생성하고, 같은 검색 조건인 동안은 rerun 후에도 다운로드 버튼 유지
+            search_csv_request = (upload_key, search_sql, tuple(where_params + search_params))
+            if st.button("검색결과 전체 CSV 생성", key="search_csv_btn"):
+                st.session_state.search_csv_request = search_csv_request
+            if st.session_state.get("search_csv_request") == search_csv_request:
+                st.download_button(
+                    "검색결과 CSV 다운로드",
+                    search_csv_bytes(upload_key, search_sql, where_params + search_params, con),
+                    file_name="search_results.csv",
+                    mime="text/csv",
+                    key="search_csv_download",
+                )
 
 
     # 전월대비 차이액 분석 섹션
@@ -1792,7 +2050,11 @@ if df is not None and not df.empty:
 
     # 자재 검색 조건과 기본 필터 조건 결합
     where_sql_with_search = where_sql
+    where_params_with_search = where_params
+    mom_table = agg_table
     if search_where:
+        mom_table = "data"
+        where_params_with_search = where_params + search_params
         if where_sql.strip() == "":
             where_sql_with_search = f"WHERE ({search_where})"
         else:
@@ -1815,12 +2077,12 @@ if df is not None and not df.empty:
                 mom_sql = f"""
                     WITH monthly_data AS (
                         SELECT
-                            date_trunc('month', 마감월) AS 연월,
+                            연월,
                             SUM(송장금액)/1000000 AS 송장금액_백만원,
                             SUM(송장수량)/1000 AS 송장수량_천EA
-                        FROM data
+                        FROM {mom_table}
                         {where_sql_with_search}
-                        GROUP BY date_trunc('month', 마감월)
+                        GROUP BY 연월
                     ),
                     with_prev AS (
                         SELECT
@@ -1852,7 +2114,7 @@ if df is not None and not df.empty:
                     ORDER BY 연월
                 """
 
-                mom_df = con.execute(mom_sql).fetchdf()
+                mom_df = con.execute(mom_sql, where_params_with_search).fetchdf()
 
                 if not mom_df.empty:
                     # 날짜 포맷 변환
@@ -1880,7 +2142,7 @@ if df is not None and not df.empty:
                     )
 
                     # CSV 다운로드
-                    csv_data = display_df.to_csv(index=False, encoding='utf-8-sig')
+                    csv_data = to_csv_bytes(display_df)
                     st.download_button(
                         label="📥 전월대비 차이 CSV 다운로드",
                         data=csv_data,
@@ -1895,13 +2157,13 @@ if df is not None and not df.empty:
                 mom_sql = f"""
                     WITH monthly_data AS (
                         SELECT
-                            date_trunc('month', 마감월) AS 연월,
+                            연월,
                             공급업체명,
                             SUM(송장금액)/1000000 AS 송장금액_백만원,
                             SUM(송장수량)/1000 AS 송장수량_천EA
-                        FROM data
+                        FROM {mom_table}
                         {where_sql_with_search}
-                        GROUP BY date_trunc('month', 마감월), 공급업체명
+                        GROUP BY 연월, 공급업체명
                     ),
                     with_prev AS (
                         SELECT
@@ -1935,7 +2197,7 @@ if df is not None and not df.empty:
                     ORDER BY 연월, 공급업체명
                 """
 
-                mom_df = con.execute(mom_sql).fetchdf()
+                mom_df = con.execute(mom_sql, where_params_with_search).fetchdf()
 
                 if not mom_df.empty:
                     # 날짜 포맷 변환
@@ -1989,7 +2251,7 @@ if df is not None and not df.empty:
                     st.subheader("업체별 구매액 비중")
 
                     # 업체별 총 구매액 집계 (당월금액 기준)
-                    supplier_summary = display_df.groupby('공급업체명').agg({
+                    supplier_summary = display_df.groupby('공급업체명', observed=True).agg({
                         '당월금액': 'sum'
                     }).reset_index()
                     supplier_summary.columns = ['공급업체명', '총구매액']
@@ -2063,7 +2325,7 @@ if df is not None and not df.empty:
                         )
 
                     # CSV 다운로드
-                    csv_data = display_df.to_csv(index=False, encoding='utf-8-sig')
+                    csv_data = to_csv_bytes(display_df)
                     st.download_button(
                         label="📥 전월대비 차이 CSV 다운로드",
                         data=csv_data,
@@ -2103,8 +2365,7 @@ if df is not None and not df.empty:
                 FROM data
                 {where_sql}
                 """
-                existing_codes_df = con.execute(existing_codes_query).fetchdf()
-                existing_codes_set = set(existing_codes_df['자재코드'].astype(str).str.strip())
+                existing_codes_set = {str(row[0]).strip() for row in con.execute(existing_codes_query, where_params).fetchall()}
 
                 # 미마감 자재 찾기 (데이터에 없는 자재코드)
                 unmatched_codes = []
@@ -2116,9 +2377,9 @@ if df is not None and not df.empty:
                         match_query = f"""
                         SELECT COUNT(*) as cnt
                         FROM data
-                        {where_sql} AND CAST(자재 AS VARCHAR) ILIKE '{pattern}'
+                        {where_sql} AND 자재코드_검색 LIKE ?
                         """
-                        match_count = con.execute(match_query).fetchdf()['cnt'].iloc[0]
+                        match_count = con.execute(match_query, where_params + [pattern]).fetchone()[0]
 
                         if match_count == 0:
                             unmatched_codes.append(code)
@@ -2154,7 +2415,7 @@ if df is not None and not df.empty:
                 # CSV 다운로드
                 st.download_button(
                     "미마감 자재 CSV 다운로드",
-                    unmatch_df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig"),
+                    to_csv_bytes(unmatch_df),
                     file_name="unmatched_materials.csv",
                     mime="text/csv",
                     key="download_unmatch_csv"
@@ -2191,31 +2452,22 @@ if df is not None and not df.empty:
     if st.button("단종 점검", type="primary", key="check_material_btn"):
         # 검색 조건 생성
         check_conditions = []
+        check_params = []
         check_info = []
 
         # 자재명 검색
         if check_material_name and check_material_name.strip():
-            name_patterns = []
             name_terms = [term.strip() for term in check_material_name.replace('\n', ',').replace(';', ',').split(',') if term.strip()]
-            for term in name_terms:
-                enhanced_patt = enhance_pattern(term)
-                name_patterns.append(f"자재명 ILIKE '{enhanced_patt}'")
-
-            if name_patterns:
-                name_clause = " OR ".join(name_patterns)
+            if name_terms:
+                name_clause = material_name_clause(search_terms_condition("자재명_검색", name_terms, check_params))
                 check_conditions.append(f"({name_clause})")
                 check_info.append(f"자재명: {len(name_terms)}개 조건")
 
         # 자재코드 검색
         if check_material_code and check_material_code.strip():
-            code_patterns = []
             code_terms = [term.strip() for term in check_material_code.replace('\n', ',').replace('\t', ',').replace(';', ',').split(',') if term.strip()]
-            for term in code_terms:
-                enhanced_patt = enhance_pattern(term)
-                code_patterns.append(f"CAST(자재 AS VARCHAR) ILIKE '{enhanced_patt}'")
-
-            if code_patterns:
-                code_clause = " OR ".join(code_patterns)
+            if code_terms:
+                code_clause = search_terms_condition("자재코드_검색", code_terms, check_params)
                 check_conditions.append(f"({code_clause})")
                 check_info.append(f"자재코드: {len(code_terms)}개 조건")
 
@@ -2243,7 +2495,7 @@ if df is not None and not df.empty:
             ORDER BY 자재코드, 업체명
             """
 
-            check_df = con.execute(check_query).fetchdf()
+            check_df = con.execute(check_query, where_params + check_params).fetchdf()
 
             # 결과를 세션 상태에 저장
             if not check_df.empty:
@@ -2290,7 +2542,7 @@ if df is not None and not df.empty:
             # CSV 다운로드
             st.download_button(
                 "단종 점검 결과 CSV 다운로드",
-                check_df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig"),
+                to_csv_bytes(check_df),
                 file_name="material_check_results.csv",
                 mime="text/csv",
                 key="download_check_csv"